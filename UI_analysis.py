@@ -0,0 +1,147 @@
+''' COHORT ANALYSIS of the data files in Nina_UI_Data
+
+    Loads every participant's data file (in parallel, with the column types
+    from UI_data.DATA_COLUMNS), puts them in one DataFrame and summarises it
+    per participant and per condition with groupbys.
+
+    Usage:
+    python UI_analysis.py [DATA_DIR] [--participants FILE] [--conditions FILE]
+                          [--workers N] [--include-practice]
+
+    DATA_DIR defaults to Nina_UI_Data next to this file. Practice trials
+    (Block_n = NaN) are left out unless --include-practice is given.
+'''
+
+import argparse
+import concurrent.futures
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from UI_data import DATA_COLUMNS, CONDITION_SEP, MISSING
+
+
+EXPERIMENT_NAME = 'Uniformity_illusion'
+
+# pandas types for the data columns (Int64 = integers that can be missing)
+DTYPES = {}
+for name, kind in DATA_COLUMNS:
+    if kind is int:
+        DTYPES[name] = 'Int64'
+    elif kind is float:
+        DTYPES[name] = 'float64'
+    else:
+        DTYPES[name] = 'string'
+
+
+def find_data_files(data_dir):
+    # the data files only, not the test, timing or session log files
+    paths = glob.glob(os.path.join(data_dir, '*_%s_*.csv' % EXPERIMENT_NAME))
+    return sorted(path for path in paths
+                  if '_TEST_' not in path and not path.endswith('_timing.csv'))
+
+
+def normalise_condition(condition):
+    # older data files have the Condition list written by pandas as
+    # "['Exp', 'Cent_big']", newer ones as Exp|Cent_big -> all like the newer
+    old = condition.str.startswith('[')
+    cleaned = (condition[old].str.strip('[]')
+               .str.replace("'", '', regex=False)
+               .str.replace(', ', CONDITION_SEP, regex=False))
+    condition = condition.copy()
+    condition[old] = cleaned
+    return condition
+
+
+def load_data_file(path):
+    data = pd.read_csv(path, dtype=DTYPES, na_values=[MISSING],
+                       keep_default_na=False)
+    data['File'] = os.path.basename(path)
+    return data
+
+
+def load_cohort(paths, workers=None):
+    ''' one DataFrame with every file in paths, plus some columns for analysis
+
+        Practice = practice trial (no block number)
+        Trial_type = 'exp', 'latency_catch' or 'UI_catch'
+        Repro_error = reproduction minus the true value (size or opacity)
+    '''
+    if not paths:
+        raise IOError('no data files to load')
+    if workers == 1 or len(paths) == 1:
+        frames = [load_data_file(path) for path in paths]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(load_data_file, paths, chunksize=8))
+    data = pd.concat(frames, ignore_index=True)
+
+    data['Condition'] = normalise_condition(data['Condition'])
+    data['Practice'] = data['Block_n'].isna()
+    data['Trial_type'] = np.select(
+        [data['Catch_latency'].eq(1).fillna(False).to_numpy(bool),
+         data['Catch_UI'].eq(1).fillna(False).to_numpy(bool)],
+        ['latency_catch', 'UI_catch'], default='exp')
+    data['Repro_error'] = np.where(data['Stimuli'].eq('Size').fillna(False),
+                                   data['Reproduction'] - data['Cent_size'],
+                                   data['Reproduction'] - data['Cent_opacity'])
+    return data
+
+
+def participant_summary(data):
+    return (data.groupby(['Sub_ID', 'Block_type'], observed=True)
+            .agg(n_trials=('Trial_n', 'size'),
+                 uniformity=('Uniformity', 'mean'),
+                 rt_mean=('RT', 'mean'),
+                 rt_median=('RT', 'median'),
+                 reproduction=('Reproduction', 'mean'),
+                 repro_error=('Repro_error', 'mean'))
+            .reset_index())
+
+
+def condition_summary(data):
+    return (data.groupby(['Block_type', 'Stimuli', 'Condition', 'Trial_type'],
+                         observed=True)
+            .agg(n_trials=('Trial_n', 'size'),
+                 n_participants=('Sub_ID', 'nunique'),
+                 uniformity=('Uniformity', 'mean'),
+                 rt_mean=('RT', 'mean'),
+                 rt_median=('RT', 'median'),
+                 reproduction=('Reproduction', 'mean'),
+                 repro_error=('Repro_error', 'mean'),
+                 repro_error_sd=('Repro_error', 'std'))
+            .reset_index())
+
+
+def main(argv=None):
+    default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'Nina_UI_Data')
+    parser = argparse.ArgumentParser(description='Summarise the uniformity illusion data files')
+    parser.add_argument('data_dir', nargs='?', default=default_dir)
+    parser.add_argument('--participants', default='summary_participants.csv',
+                        help='output file for the per participant summary')
+    parser.add_argument('--conditions', default='summary_conditions.csv',
+                        help='output file for the per condition summary')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes used to load the files (default = all cores)')
+    parser.add_argument('--include-practice', action='store_true')
+    args = parser.parse_args(argv)
+
+    paths = find_data_files(args.data_dir)
+    data = load_cohort(paths, workers=args.workers)
+    if not args.include_practice:
+        data = data[~data['Practice']]
+    print('loaded %i trials of %i participants from %i files'
+          % (len(data), data['Sub_ID'].nunique(), len(paths)))
+
+    participants = participant_summary(data)
+    conditions = condition_summary(data)
+    participants.to_csv(args.participants, index=False)
+    conditions.to_csv(args.conditions, index=False)
+    print(conditions.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
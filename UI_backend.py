@@ -0,0 +1,271 @@
+''' RENDERING BACKENDS for sticky_perception_UI.py
+
+    The experiment script asks a backend for its window, stimuli, mouse and
+    keyboard instead of calling psychopy.visual/psychopy.event directly, so
+    the same trial engine can run without a screen:
+
+    window    = the real thing, fullscreen psychopy window (default)
+    offscreen = psychopy window that is not fullscreen and does not wait for
+                the vertical blank. On a machine without a display run it
+                under a virtual X server, e.g. xvfb-run
+    null      = psychopy.visual is never imported. Stimuli are plain objects
+                that keep their attributes (so the trial code runs exactly as
+                normal) and draw()/flip() only count. The mouse confirms
+                everything straight away, waiting for a key returns space
+                and nothing else is ever typed.
+
+    The null window's flips get their time from a clock (UI_clock.py), with
+    the virtual clock each flip is exactly one frame after the last.
+
+    make_backend(name, null_input=True) = the same, but the window/offscreen
+    backends get the null mouse and keyboard too, so the instruction screens
+    go by on their own (for --simulate).
+'''
+
+import numpy as np
+
+from UI_clock import REAL_CLOCK
+
+
+## REAL PSYCHOPY WINDOW
+class PsychopyBackend(object):
+
+    def __init__(self, fullscr=True, wait_blanking=True, null_input=False):
+        # only imported here, both need a display
+        import psychopy.visual
+        import psychopy.event
+        self.visual_module = psychopy.visual
+        self.event_module = psychopy.event
+        self.fullscr = fullscr
+        self.wait_blanking = wait_blanking
+        # no person: mouse and keys like the null backend
+        self.null_input = null_input
+
+    def window(self, size, color, allow_stencil, monitor_name):
+        from psychopy import monitors
+        return self.visual_module.Window(
+            size=size,
+            allowStencil=allow_stencil,
+            units='pix',
+            fullscr=self.fullscr,
+            waitBlanking=self.wait_blanking,
+            color=color,
+            monitor = monitors.Monitor(monitor_name))
+
+    def visual(self, name, *args, **kwargs):
+        # any psychopy.visual class by name, e.g. visual('TextBox', win, ...)
+        return getattr(self.visual_module, name)(*args, **kwargs)
+
+    def mouse(self, visible=True):
+        if self.null_input:
+            return NullMouse(visible)
+        return self.event_module.Mouse(visible=visible)
+
+    def add_global_key(self, key, func):
+        self.event_module.globalKeys.add(key, func)
+
+    def wait_keys(self):
+        if self.null_input:
+            return ['space']
+        return self.event_module.waitKeys()
+
+    def get_keys(self, keyList=None):
+        if self.null_input:
+            return []
+        return self.event_module.getKeys(keyList=keyList)
+
+
+## NULL RENDERER
+class NullWindow(object):
+
+    def __init__(self, size, color, refresh_rate=60.0, clock=REAL_CLOCK):
+        self.clock = clock
+        self.size = size
+        self.color = color
+        self.units = 'pix'
+        self.refresh_rate = refresh_rate
+        self.monitorFramePeriod = 1.0 / refresh_rate
+        self.mouseVisible = True
+        self.closed = False
+        # counters, to see what the trial loop costs
+        self.n_flips = 0
+        self.n_draws = 0
+        self.first_flip = None
+        self.last_flip = None
+
+    def flip(self, clearBuffer=True):
+        now = self.clock.next_frame(self.monitorFramePeriod)
+        if self.first_flip is None:
+            self.first_flip = now
+        self.last_flip = now
+        self.n_flips += 1
+        return now
+
+    def clearBuffer(self):
+        pass
+
+    def getActualFrameRate(self, *args, **kwargs):
+        return self.refresh_rate
+
+    def setMouseVisible(self, visible):
+        self.mouseVisible = visible
+
+    def close(self):
+        self.closed = True
+
+    def stats(self):
+        if self.n_flips < 2:
+            return 'null window: %i flips' % self.n_flips
+        dur = self.last_flip - self.first_flip
+        return ('null window: %i flips, %i draws in %.1f s (%.3f ms per frame)'
+                % (self.n_flips, self.n_draws, dur,
+                   1000 * dur / (self.n_flips - 1)))
+
+
+class NullStim(object):
+    # stand in for any psychopy stimulus: keeps whatever it is given
+
+    def __init__(self, win, **kwargs):
+        self.win = win
+        self.autoDraw = False
+        self.__dict__.update(kwargs)
+
+    def draw(self, win=None):
+        self.win.n_draws += 1
+
+    def setText(self, text):
+        self.text = text
+
+
+class NullElementArray(NullStim):
+    # keeps per element attributes as arrays of the same shape psychopy uses,
+    # so things like grid.sizes *= [scale,1] and grid.opacities[1] still work
+
+    def __init__(self, win, nElements=100, sizes=2.0, xys=None, **kwargs):
+        self.nElements = nElements
+        NullStim.__init__(self, win, **kwargs)
+        self.xys = np.zeros((nElements, 2)) if xys is None else xys
+        self.sizes = sizes
+        self.opacities = 1.0
+        self.colors = (1.0, 1.0, 1.0)
+        self.oris = 0
+
+    def _per_element(self, value, width):
+        value = np.array(value, dtype=float)
+        if value.ndim == 0 or value.shape == (width,):
+            value = np.resize(value, (self.nElements, width))
+        elif value.shape == (self.nElements,) and width > 1:
+            value = value.reshape(-1, 1).repeat(width, 1)
+        if width == 1:
+            return value.reshape(self.nElements)
+        return value
+
+    @property
+    def xys(self):
+        return self._xys
+
+    @xys.setter
+    def xys(self, value):
+        if (isinstance(value, np.ndarray) and not value.flags.writeable
+                and value.shape == (self.nElements, 2)):
+            # shared coords (UI_stimuli.share_coords), not copied
+            self._xys = value
+        else:
+            self._xys = self._per_element(value, 2)
+
+    @property
+    def sizes(self):
+        return self._sizes
+
+    @sizes.setter
+    def sizes(self, value):
+        self._sizes = self._per_element(value, 2)
+
+    @property
+    def opacities(self):
+        return self._opacities
+
+    @opacities.setter
+    def opacities(self, value):
+        self._opacities = self._per_element(value, 1)
+
+    @property
+    def colors(self):
+        return self._colors
+
+    @colors.setter
+    def colors(self, value):
+        self._colors = self._per_element(value, 3)
+
+    @property
+    def oris(self):
+        return self._oris
+
+    @oris.setter
+    def oris(self, value):
+        self._oris = self._per_element(value, 1)
+
+
+class NullMouse(object):
+    # every poll is a left click, so no phase ever waits for a person
+
+    def __init__(self, visible=True):
+        self.visible = visible
+
+    def getPressed(self, getTime=False):
+        if getTime:
+            return [1, 0, 0], [0.0, 0.0, 0.0]
+        return [1, 0, 0]
+
+    def getWheelRel(self):
+        return np.array([0.0, 0.0])
+
+    def clickReset(self, buttons=(0, 1, 2)):
+        pass
+
+    def isPressedIn(self, shape, buttons=(0, 1, 2)):
+        return True
+
+    def setVisible(self, visible):
+        self.visible = visible
+
+
+class NullBackend(object):
+
+    def __init__(self, refresh_rate=60.0, clock=REAL_CLOCK):
+        self.refresh_rate = refresh_rate
+        self.clock = clock
+
+    def window(self, size, color, allow_stencil, monitor_name):
+        return NullWindow(size, color, self.refresh_rate, self.clock)
+
+    def visual(self, name, win, *args, **kwargs):
+        if name == 'ElementArrayStim':
+            return NullElementArray(win, *args, **kwargs)
+        return NullStim(win, **kwargs)
+
+    def mouse(self, visible=True):
+        return NullMouse(visible)
+
+
+    def add_global_key(self, key, func):
+        pass
+
+    def wait_keys(self):
+        return ['space']
+
+    def get_keys(self, keyList=None):
+        return []
+
+
+BACKENDS = ['window', 'offscreen', 'null']
+
+def make_backend(name, null_input=False, clock=REAL_CLOCK):
+    # clock = only for the null backend, a real window flips in real time
+    if name == 'window':
+        return PsychopyBackend(fullscr=True, wait_blanking=True, null_input=null_input)
+    elif name == 'offscreen':
+        return PsychopyBackend(fullscr=False, wait_blanking=False, null_input=null_input)
+    elif name == 'null':
+        return NullBackend(clock=clock)
+    raise ValueError('unknown backend %r, must be one of %s' % (name, BACKENDS))
@@ -0,0 +1,358 @@
+''' BENCHMARKS for the trial engine of sticky_perception_UI.py
+
+    Times the parts the experiment spends its time on and compares them with
+    a saved baseline, so a change to the trial engine is measured instead of
+    guessed:
+
+    coords/...  = make_stim_coords at several grid densities, worked out
+                  (cold, no memory or disk cache) and from the cache (warm)
+    grid/...    = materialising a stimuli_grid spec as a merged grid (what
+                  the stimuli pool does the first time a trial uses it)
+    frame/...   = one frame of every trial phase, for the Size, Colour and
+                  the two catch stimuli. With the null backend (default)
+                  draw() does nothing, so this is only the CPU side (attribute
+                  updates, colour blending, flip bookkeeping), NOT the cost of
+                  drawing. Run with --backend offscreen for real rendering
+    output/...  = writing one finished trial: session log, data row and
+                  timing row (with and without fsync)
+
+    Usage:
+    python UI_benchmarks.py [--backend null|offscreen] [--baseline FILE]
+                            [--save-baseline] [--tolerance 0.25]
+                            [--noise-floor 10] [--only TEXT]
+
+    Every benchmark is the median of --repeat runs, each long enough to take
+    at least 0.2 s. Without --save-baseline the results are compared with the
+    baseline file (if there is one) and the exit status is 1 when any of them
+    got slower than baseline * (1 + tolerance) AND by more than --noise-floor
+    microseconds (benchmarks that take a microsecond or two move by more than
+    25% between runs without any change). TOLERANCES overrides --tolerance
+    for benchmarks that are noisy by nature. Baselines only mean something
+    on the machine (and backend) they were saved on, so none is shipped: save
+    one before making a change, then run again after it.
+'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+import UI_stimuli
+from UI_backend import make_backend
+from UI_data import DATA_COLUMNS, SessionWriter, SessionLog
+from UI_noise import NoiseBank
+from UI_stimuli import StimSpec, make_stim_coords, make_merged_grid
+from UI_timing import FlipRecorder, ramp_table
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'UI_benchmarks_baseline.json')
+
+# the same values as the experiment (sticky_perception_UI.py)
+SCALE = 0.563
+APERTURE_SIZE = (0.97, 1)
+SMALL, BIG = 0.06, 0.09
+REPRO_SIZE = SMALL + (BIG - SMALL) / 2
+COLOUR_STIM_SIZE = 0.1
+FRAME_PERIOD = 1.0 / 60
+GRID_ARGS = (-0.95, 0.975, 0.95, -1.05)
+
+# columns x rows, the experiment uses 18x12
+DENSITIES = [(10, 8), (18, 12), (36, 24), (72, 48)]
+
+# tolerance of the benchmarks that don't use --tolerance (name starts with
+# the key): fsync times the disk more than the code
+TOLERANCES = {'output/trial_fsync': 1.0}
+
+
+## TIMING
+def time_per_call(func, repeat=5):
+    # median secs per call of func() over repeat runs of at least 0.2 s
+    timer = timeit.Timer(func)
+    number = timer.autorange()[0]
+    return float(np.median(timer.repeat(repeat, number))) / number
+
+
+## BENCHMARKS
+def coords_benchmarks():
+    benchmarks = {}
+    for stim_type in ('size', 'colour'):
+        for x_circles, y_circles in DENSITIES:
+            args = (stim_type, x_circles, y_circles) + GRID_ARGS
+            name = 'coords/%s/%ix%i' % (stim_type, x_circles, y_circles)
+
+            def cold(args=args):
+                UI_stimuli._cached_coords.cache_clear()
+                make_stim_coords(*args)
+
+            benchmarks[name + '/cold'] = cold
+            benchmarks[name + '/warm'] = lambda args=args: make_stim_coords(*args)
+    return benchmarks
+
+
+def experiment_specs():
+    # the stimuli of one Size, Colour and catch trial (see stim lists in the
+    # experiment script)
+    coords_size = make_stim_coords('size', 18, 12, *GRID_ARGS)
+    coords_colour = make_stim_coords('colour', 18, 12, *GRID_ARGS)
+    size = {'Cent': StimSpec(coords_size, 1, SMALL, 'circle', 0, (1, 1, 0)),
+            'Periph': StimSpec(coords_size, 1, BIG, 'circle', 0, (1, 1, 0)),
+            'Cent_new': StimSpec(coords_size, 1, BIG, 'circle', 0, (1, 1, 0)),
+            'Repro': StimSpec(coords_size, 1, REPRO_SIZE, 'circle', 0, (1, 1, 0))}
+    colour = {'Cent': StimSpec(coords_colour, 1, COLOUR_STIM_SIZE, 'circle', 0, (0, 0, 1)),
+              'Periph': StimSpec(coords_colour, 1, COLOUR_STIM_SIZE, 'circle', 0, (0, 0.75, 0.7)),
+              'Cent_new': StimSpec(coords_colour, 1, COLOUR_STIM_SIZE, 'circle', 0, (0, 0.75, 0.7)),
+              'Repro': StimSpec(coords_colour, 0.5, COLOUR_STIM_SIZE, 'circle', 0, (0, 0, 1)),
+              'Catch': StimSpec(coords_colour, 1, COLOUR_STIM_SIZE, 'circle', 0, (0, 0, 1))}
+    return {'Size': size, 'Colour': colour}
+
+
+def grid_benchmarks(backend, win):
+    benchmarks = {}
+    for name, specs in experiment_specs().items():
+        spec = specs['Cent']
+        benchmarks['grid/%s' % name] = (
+            lambda spec=spec: make_merged_grid(backend, win, spec, SCALE, APERTURE_SIZE))
+    return benchmarks
+
+
+def frame_benchmarks(backend, win):
+    ''' one frame of each phase, set up like RUN_TRIALS does it
+
+        the catch and reproduction frames change the grid every frame (the
+        most a frame ever does)
+    '''
+    benchmarks = {}
+    specs = experiment_specs()
+    size_table = np.outer(ramp_table(SMALL, BIG, 8, FRAME_PERIOD), [SCALE, 1])
+    alpha_table = ramp_table(0, 1, 8, FRAME_PERIOD)
+    counter = {'frame': 0}
+
+    def next_row(table):
+        counter['frame'] = (counter['frame'] + 1) % len(table)
+        return table[counter['frame']]
+
+    for name, spec in specs.items():
+        grid = make_merged_grid(backend, win, spec['Cent'], SCALE, APERTURE_SIZE)
+        stimulus = grid.phase(centre=spec['Cent'], periphery=spec['Periph'])
+        centre_change = grid.phase(centre=spec['Cent_new'], periphery=spec['Periph'])
+        if name == 'Size':
+            reproduction = grid.phase(periphery=spec['Repro'])
+        else:
+            reproduction = grid.phase(periphery=spec['Periph'])
+
+        def show_and_draw(grid=grid, phase=stimulus):
+            if grid.base is not phase:
+                grid.show(phase)
+            grid.draw()
+
+        benchmarks['frame/%s/stimulus' % name] = show_and_draw
+        benchmarks['frame/%s/centre_change' % name] = (
+            lambda grid=grid, phase=centre_change: show_and_draw(grid, phase))
+
+        if name == 'Size':
+            def catch(grid=grid, phase=stimulus):
+                if grid.base is not phase:
+                    grid.show(phase)
+                grid.set_sizes('periphery', next_row(size_table))
+                grid.draw()
+
+            def repro(grid=grid, phase=reproduction):
+                if grid.base is not phase:
+                    grid.show(phase)
+                value = REPRO_SIZE + 0.002 * (counter['frame'] % 5)
+                counter['frame'] += 1
+                grid.set_sizes('periphery', [value * SCALE, value])
+                grid.draw()
+        else:
+            def catch(grid=grid, phase=stimulus, spec=spec):
+                if grid.base is not phase:
+                    grid.show(phase)
+                grid.overlay('periphery', spec['Catch'], next_row(alpha_table))
+                grid.draw()
+
+            def repro(grid=grid, phase=reproduction, spec=spec):
+                if grid.base is not phase:
+                    grid.show(phase)
+                counter['frame'] += 1
+                grid.overlay('periphery', spec['Repro'], 0.5 + 0.02 * (counter['frame'] % 5))
+                grid.draw()
+
+        benchmarks['frame/%s_catch/stimulus' % name] = catch
+        benchmarks['frame/%s/reproduction' % name] = repro
+
+    noise = NoiseBank(backend, win, n_images=60, seed=0, background=False)
+    noise.make_stims()
+    flips = FlipRecorder(FRAME_PERIOD)
+
+    def noise_frame():
+        if flips.counts['iti_noise'] == 4000:
+            # a new trial before the flip buffer has to grow
+            flips.start_trial()
+        counter['frame'] += 1
+        noise.draw(counter['frame'])
+        flips.flip(win, 'iti_noise')
+
+    # the noise phases, with the flip and its bookkeeping
+    benchmarks['frame/noise_and_flip'] = noise_frame
+    return benchmarks
+
+
+def output_benchmarks(out_dir, files):
+    # one trial's writes, in the order RUN_TRIALS does them
+    # files = list the writers are added to (closed when done)
+    benchmarks = {}
+    flips = FlipRecorder(FRAME_PERIOD)
+    row = {}
+    for name, kind in DATA_COLUMNS:
+        row[name] = 'x' if kind is str else (['Exp', 'Cent_big'] if kind == 'list' else 1)
+    for fsync in (False, True):
+        path = os.path.join(out_dir, 'data_fsync%i.csv' % fsync)
+        data_file = SessionWriter(path, DATA_COLUMNS, flush_every=1, fsync=fsync)
+        timing_file = SessionWriter(path + '_timing.csv', [('Trial_n', int)] + flips.columns(),
+                                    flush_every=1)
+        session_log = SessionLog(path + '_session.jsonl', fsync=fsync)
+
+        def write_trial(data_file=data_file, timing_file=timing_file,
+                        session_log=session_log):
+            fields = data_file.format(row)
+            session_log.trial(1, 'main', fields)
+            data_file.write_fields(fields)
+            timing = flips.summary()
+            timing['Trial_n'] = data_file.rows_written
+            timing_file.write(timing)
+
+        benchmarks['output/trial%s' % ('_fsync' if fsync else '')] = write_trial
+        files.extend([data_file, timing_file, session_log])
+    return benchmarks
+
+
+## BASELINES
+def machine():
+    return {'node': platform.node(), 'machine': platform.machine(),
+            'python': platform.python_version(), 'numpy': np.__version__}
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(path, backend_name, results):
+    baseline = {'backend': backend_name, 'machine': machine(), 'results': results}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def benchmark_tolerance(name, tolerance):
+    for prefix, value in TOLERANCES.items():
+        if name.startswith(prefix):
+            return value
+    return tolerance
+
+
+def compare(results, baseline, tolerance, noise_floor):
+    # names of the benchmarks slower than baseline * (1 + tolerance) and by
+    # more than noise_floor secs
+    regressions = []
+    for name, secs in sorted(results.items()):
+        base = baseline['results'].get(name)
+        if base is None:
+            print('%-40s %12.3f us   (no baseline)' % (name, secs * 1e6))
+            continue
+        ratio = secs / base
+        flag = ''
+        if (ratio > 1 + benchmark_tolerance(name, tolerance)
+                and secs - base > noise_floor):
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-40s %12.3f us   x%.2f%s' % (name, secs * 1e6, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the trial engine')
+    parser.add_argument('--backend', choices=['null', 'offscreen'], default='null',
+                        help='offscreen = real drawing (needs a display)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slow down before it is a regression (0.25 = 25%%)')
+    parser.add_argument('--noise-floor', type=float, default=10.0,
+                        help='slow downs smaller than this many microseconds are never a regression')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', default=None,
+                        help='only benchmarks whose name contains this')
+    args = parser.parse_args(argv)
+
+    backend = make_backend(args.backend)
+    win = backend.window(size=[684, 456], color=[-1, -1, -1], allow_stencil=False,
+                         monitor_name='samplingExperiment')
+    win.units = 'norm'
+
+    # no disk cache, the cold coords are really worked out
+    UI_stimuli.COORD_CACHE_DIR = None
+    out_dir = tempfile.mkdtemp(prefix='UI_benchmarks_')
+    benchmarks = {}
+    benchmarks.update(coords_benchmarks())
+    benchmarks.update(grid_benchmarks(backend, win))
+    benchmarks.update(frame_benchmarks(backend, win))
+    files = []
+    benchmarks.update(output_benchmarks(out_dir, files))
+
+    results = {}
+    try:
+        for name in sorted(benchmarks):
+            if args.only is not None and args.only not in name:
+                continue
+            results[name] = time_per_call(benchmarks[name], repeat=args.repeat)
+    finally:
+        for output_file in files:
+            output_file.close()
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    baseline = None if args.save_baseline else load_baseline(args.baseline)
+    regressions = []
+    if baseline is None:
+        for name, secs in sorted(results.items()):
+            print('%-40s %12.3f us' % (name, secs * 1e6))
+    else:
+        if baseline.get('backend') != args.backend or baseline.get('machine') != machine():
+            print('baseline is from another machine or backend: %s, %s'
+                  % (baseline.get('backend'), baseline.get('machine')))
+        regressions = compare(results, baseline, args.tolerance, args.noise_floor * 1e-6)
+
+    if args.save_baseline:
+        if args.only is not None:
+            # keep the others
+            old = load_baseline(args.baseline)
+            if old is not None:
+                results = dict(old['results'], **results)
+        save_baseline(args.baseline, args.backend, results)
+        print('baseline saved to %s' % args.baseline)
+
+    if args.backend == 'null':
+        print('null backend: frame/ is the CPU side of a frame only, nothing is drawn '
+              '(--backend offscreen for rendering)')
+
+    if regressions:
+        print('%i benchmark(s) slower than the baseline by more than %i%% and %g us: %s'
+              % (len(regressions), round(args.tolerance * 100), args.noise_floor,
+                 ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
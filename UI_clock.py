@@ -0,0 +1,91 @@
+''' CLOCKS for sticky_perception_UI.py
+
+    Everything that needs the time (flip times of the null window, mouse
+    events, gaze samples, the instruction demo) asks a clock for it instead
+    of calling psychopy.core.getTime() itself:
+
+    real    = psychopy.core.getTime(), the same clock as win.flip (default)
+    virtual = time that only moves when it is moved: every flip of the null
+              window is exactly one frame later and waiting takes no time,
+              so hours of session timing run in milliseconds and come out
+              the same every time (--clock virtual, null backend only)
+
+    Timer is psychopy.core.Clock (time since the last reset) on any of them.
+'''
+
+import fractions
+
+import psychopy.core
+
+
+class RealClock(object):
+
+    virtual = False
+
+    def getTime(self):
+        return psychopy.core.getTime()
+
+    def next_frame(self, frame_period):
+        # time of a flip (the null window doesn't wait for anything)
+        return psychopy.core.getTime()
+
+    def wait(self, secs):
+        psychopy.core.wait(secs)
+
+
+def _exact(secs):
+    # secs as a fraction: the float it came from rounded to the simplest
+    # fraction that close (1/60 for a 60 Hz frame), so adding up thousands of
+    # frames doesn't build up float error
+    return fractions.Fraction(secs).limit_denominator(10**9)
+
+
+class VirtualClock(object):
+
+    virtual = True
+
+    def __init__(self, start=0.0):
+        # kept as a fraction, only turned into a float when it is read
+        self.time = _exact(start)
+
+    def getTime(self):
+        return float(self.time)
+
+    def next_frame(self, frame_period):
+        self.advance(frame_period)
+        return float(self.time)
+
+    def advance(self, secs):
+        if secs < 0:
+            raise ValueError('a virtual clock only goes forward')
+        self.time += _exact(secs)
+
+    def wait(self, secs):
+        self.advance(secs)
+
+
+class Timer(object):
+    # like psychopy.core.Clock: secs since it was made or reset
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self.start = self.clock.getTime()
+
+    def getTime(self):
+        return self.clock.getTime() - self.start
+
+
+# the clock everything uses unless it is given another one
+REAL_CLOCK = RealClock()
+
+CLOCKS = ['real', 'virtual']
+
+def make_clock(name):
+    if name == 'real':
+        return REAL_CLOCK
+    elif name == 'virtual':
+        return VirtualClock()
+    raise ValueError('unknown clock %r, must be one of %s' % (name, CLOCKS))
@@ -0,0 +1,218 @@
+''' DATA FILES for sticky_perception_UI.py
+
+    SessionWriter appends one row per trial to a csv file as soon as the
+    trial is done (it used to go into a dict of lists that was turned into a
+    DataFrame and rewritten in full at the end of every block, with a separate
+    hand written back up txt file). Every column has a type, missing values
+    are written as NaN and the Condition list is written as one field.
+
+    SessionLog is the write ahead log of a session (which blocks ran, their
+    trial sequences, the random generator state and every finished row) so an
+    interrupted session can be carried on with --resume.
+'''
+
+import csv
+import glob
+import json
+import math
+import os
+
+
+# columns of the data file, in order, with their type
+# 'list' = list of strings, written as one field joined by CONDITION_SEP
+DATA_COLUMNS = [
+    ('Sub_ID', str), ('Block_n', int), ('Block_type', str), ('Trial_n', int),
+    ('Trial_Rep_n', int), ('Rep_n', int), ('Trial_index', int),
+    ('Stimuli', str), ('Condition', 'list'), ('Exp', int), ('Catch_UI', int),
+    ('Catch_latency', int), ('Cent_size', float), ('Cent_opacity', float),
+    ('RT', float), ('RT_onset', float), ('RT_response', float),
+    ('Reproduction', float), ('Uniformity', int), ('Fix_breaks', int)]
+
+CONDITION_SEP = '|'
+MISSING = 'NaN'
+
+
+def is_missing(value):
+    return (value is None or (isinstance(value, str) and value == MISSING)
+            or (isinstance(value, float) and math.isnan(value)))
+
+
+def format_value(value, kind):
+    if is_missing(value):
+        return MISSING
+    if kind == 'list':
+        return CONDITION_SEP.join(str(part) for part in value)
+    if kind is int:
+        return str(int(value))
+    if kind is float:
+        # repr keeps every digit, also turns numpy floats into plain numbers
+        return repr(float(value))
+    return str(value)
+
+
+class SessionWriter(object):
+    ''' append only csv writer, one typed row per call to write()
+
+        columns = list of (name, type) like DATA_COLUMNS
+        flush_every = flush to the OS every n rows (0 = only on close)
+        fsync = also ask the OS to put it on disk when flushing, so a crash
+                loses at most flush_every rows
+        The header is only written when the file is new, so it can be
+        reopened to carry on a session. The time a row takes doesn't depend
+        on how long the session has been going.
+    '''
+
+    def __init__(self, path, columns, flush_every=1, fsync=False):
+        self.path = path
+        self.columns = list(columns)
+        self.flush_every = flush_every
+        self.fsync = fsync
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        self.rows_written = 0
+        if new_file:
+            self.writer.writerow([name for name, kind in self.columns])
+            self.flush()
+        else:
+            # carrying on an old file, count the rows that are already there
+            with open(path, newline='') as old_file:
+                self.rows_written = max(sum(1 for line in csv.reader(old_file)) - 1, 0)
+
+    def format(self, row):
+        # the row as the list of strings that goes in the file
+        return [format_value(row[name], kind) for name, kind in self.columns]
+
+    def write(self, row):
+        self.write_fields(self.format(row))
+
+    def write_fields(self, fields):
+        self.writer.writerow(fields)
+        self.rows_written += 1
+        if self.flush_every and self.rows_written % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+## SESSION LOG
+class SessionLog(object):
+    ''' write ahead log of a session, one json object per line
+
+        session = participant info (incl. seed and date) at the start
+        block   = trial sequence of one part ('practice' or 'main') of a block
+                  and the random generator state after making it, logged
+                  before the first trial runs
+        trial   = the finished data row, logged before it goes in the data
+                  file, so the data file can always be fixed from the log
+        requeue = the next trial of the part was aborted (fixation broken)
+                  and moved back after `later` of the trials still to run
+                  (later = None: dropped, it broke too often), `trial` = its
+                  logged sequence entry from now on (with the new break count)
+        part_end, end = a part of a block / the session finished
+    '''
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self.file = open(path, 'a')
+
+    def write(self, event, **fields):
+        fields['event'] = event
+        self.file.write(json.dumps(fields) + '\n')
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def session(self, info):
+        self.write('session', info=info)
+
+    def block(self, block_n, part, trials, rng_state):
+        self.write('block', block_n=block_n, part=part, trials=trials,
+                   rng_state=rng_state)
+
+    def trial(self, block_n, part, fields):
+        self.write('trial', block_n=block_n, part=part, fields=fields)
+
+    def requeue(self, block_n, part, later, trial=None):
+        self.write('requeue', block_n=block_n, part=part, later=later,
+                   trial=trial)
+
+    def part_end(self, block_n, part):
+        self.write('part_end', block_n=block_n, part=part)
+
+    def end(self):
+        self.write('end')
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def session_log_name(data_filename):
+    return data_filename + '_session.jsonl'
+
+
+def find_session(data_dir, participant, experiment_name):
+    # newest session log of a participant
+    pattern = os.path.join(data_dir, session_log_name(
+            '%s_%s_*.csv' % (glob.escape(participant), experiment_name)))
+    paths = glob.glob(pattern)
+    if not paths:
+        raise IOError('no session log for participant %r in %s'
+                      % (participant, data_dir))
+    return max(paths, key=os.path.getmtime)
+
+
+def load_session(path):
+    ''' what a session log says has been done
+
+        info = participant info from the start of the session
+        parts = {(block_n, part): {'trials': logged sequence (requeued trials
+                 moved), 'done': number of finished trials, 'finished': True/False}}
+        rng_state = random generator state after the last logged sequence
+        rows = every finished data row (list of strings), in order
+        finished = the whole session ended
+    '''
+    state = {'info': None, 'parts': {}, 'rng_state': None, 'rows': [],
+             'finished': False}
+    with open(path) as log_file:
+        for line in log_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # half written last line of a crash
+                break
+            event = entry['event']
+            if event == 'session':
+                state['info'] = entry['info']
+            elif event == 'block':
+                state['parts'][(entry['block_n'], entry['part'])] = {
+                    'trials': entry['trials'], 'done': 0, 'finished': False}
+                state['rng_state'] = entry['rng_state']
+            elif event == 'trial':
+                state['parts'][(entry['block_n'], entry['part'])]['done'] += 1
+                state['rows'].append(entry['fields'])
+            elif event == 'requeue':
+                logged = state['parts'][(entry['block_n'], entry['part'])]
+                trial = logged['trials'].pop(logged['done'])
+                if entry.get('trial') is not None:
+                    # counts the break (older logs: moved as it was)
+                    trial = entry['trial']
+                if entry['later'] is not None:
+                    logged['trials'].insert(logged['done'] + entry['later'], trial)
+            elif event == 'part_end':
+                state['parts'][(entry['block_n'], entry['part'])]['finished'] = True
+            elif event == 'end':
+                state['finished'] = True
+    if state['info'] is None:
+        raise ValueError('%s is not a session log' % path)
+    return state
@@ -0,0 +1,441 @@
+''' EYE TRACKING for sticky_perception_UI.py
+
+    GazeRecorder takes the gaze samples from a tracker every frame (it
+    listens to the FlipRecorder, see UI_timing.py), keeps them in a ring
+    buffer that is allocated once and writes them to one binary file per
+    block between trials. Every trial start/end and the first flip of every
+    trial phase are stamped as messages, with the flip time, in a messages
+    file next to it (and sent to the tracker too).
+
+    Trackers:
+    eyelink   = EyeLink through psychopy.iohub (IohubTracker)
+    simulated = no hardware: synthetic fixations with noise and saccades, or
+                a recorded gaze file replayed (SimulatedTracker)
+    off       = NullGaze, does nothing
+
+    FixationMonitor checks the new samples on every flip of the trial phases
+    it watches and marks the trial broken when the gaze has been away from
+    the fixation point for longer than a tolerance window.
+
+    Gaze files are raw GAZE_DTYPE records, read them with load_gaze(). The
+    positions are normalised window units (like the stimuli), times are
+    psychopy.core.getTime (like the flips and the mouse events), or the
+    clock the simulated tracker and the recorder are given (UI_clock.py).
+'''
+
+import numpy as np
+
+from UI_clock import REAL_CLOCK
+
+
+# one gaze sample
+GAZE_DTYPE = np.dtype([('time', '<f8'), ('x', '<f4'), ('y', '<f4'),
+                       ('pupil', '<f4'), ('valid', 'u1')])
+
+EYETRACKERS = ['off', 'eyelink', 'simulated']
+
+
+def load_gaze(path):
+    return np.fromfile(path, dtype=GAZE_DTYPE)
+
+
+def gaze_file_name(data_filename, block_n):
+    return '%s_gaze_block%s.bin' % (data_filename, block_n)
+
+
+## RING BUFFER
+class GazeRingBuffer(object):
+    ''' fixed size buffer of gaze samples, the oldest are overwritten (and
+        counted in dropped) if it isn't emptied in time
+    '''
+
+    def __init__(self, capacity):
+        self.data = np.zeros(capacity, dtype=GAZE_DTYPE)
+        self.capacity = capacity
+        self.start = 0
+        self.count = 0
+        self.dropped = 0
+
+    def extend(self, samples):
+        n = len(samples)
+        if n == 0:
+            return
+        if n > self.capacity:
+            self.dropped += n - self.capacity
+            samples = samples[-self.capacity:]
+            n = self.capacity
+        overflow = self.count + n - self.capacity
+        if overflow > 0:
+            self.start = (self.start + overflow) % self.capacity
+            self.count -= overflow
+            self.dropped += overflow
+        end = (self.start + self.count) % self.capacity
+        first = min(n, self.capacity - end)
+        self.data[end:end + first] = samples[:first]
+        self.data[:n - first] = samples[first:]
+        self.count += n
+
+    def last(self):
+        # newest sample, None if the buffer is empty
+        if self.count == 0:
+            return None
+        return self.data[(self.start + self.count - 1) % self.capacity]
+
+    def write(self, out_file):
+        # every sample, oldest first, then the buffer is empty
+        end = self.start + self.count
+        if end <= self.capacity:
+            self.data[self.start:end].tofile(out_file)
+        else:
+            self.data[self.start:].tofile(out_file)
+            self.data[:end - self.capacity].tofile(out_file)
+        self.start = 0
+        self.count = 0
+
+
+## TRACKERS
+class IohubTracker(object):
+    # EyeLink (or any iohub eye tracker), gaze turned from pixels into norm
+
+    def __init__(self, tracker, window_size):
+        from psychopy.iohub.constants import EventConstants
+        self.tracker = tracker
+        self.half_size = np.array(window_size, dtype=float) / 2.0
+        self.monocular = EventConstants.MONOCULAR_EYE_SAMPLE
+        self.binocular = EventConstants.BINOCULAR_EYE_SAMPLE
+
+    def start(self):
+        self.tracker.setRecordingState(True)
+
+    def stop(self):
+        self.tracker.setRecordingState(False)
+
+    def samples(self):
+        events = self.tracker.getEvents()
+        samples = np.zeros(len(events), dtype=GAZE_DTYPE)
+        n = 0
+        for event in events:
+            if event.type == self.monocular:
+                x, y, pupil = event.gaze_x, event.gaze_y, event.pupil_measure1
+            elif event.type == self.binocular:
+                # both eyes, the mean
+                x = (event.left_gaze_x + event.right_gaze_x) / 2.0
+                y = (event.left_gaze_y + event.right_gaze_y) / 2.0
+                pupil = (event.left_pupil_measure1 + event.right_pupil_measure1) / 2.0
+            else:
+                continue
+            samples[n] = (event.time, x / self.half_size[0],
+                          y / self.half_size[1], pupil, event.status == 0)
+            n += 1
+        return samples[:n]
+
+    def message(self, text):
+        self.tracker.sendMessage(text)
+
+    def calibrate(self):
+        self.tracker.runSetupProcedure()
+
+    def close(self):
+        self.tracker.setConnectionState(False)
+
+
+class SimulatedTracker(object):
+    ''' stand in for an eye tracker, makes the samples that would have come
+        in since the last call
+
+        rate = samples per sec
+        noise = sd of the gaze around the fixation point (norm)
+        saccade_rate = new fixation points per sec, spread = sd of where they
+                       are around the middle of the screen
+        break_rate = glances away from the middle per sec (0 = never), each
+                     break_distance (norm) away in a random direction for
+                     break_dur secs, long enough to break the fixation
+        replay = gaze file (load_gaze format) to replay instead, from its
+                 start and round again, with new times
+        seed = for the synthetic gaze
+        clock = whose time the samples are made in
+    '''
+
+    def __init__(self, rate=500.0, noise=0.005, saccade_rate=0.5, spread=0.03,
+                 break_rate=0.0, break_distance=0.5, break_dur=0.5,
+                 replay=None, seed=None, clock=REAL_CLOCK):
+        self.clock = clock
+        self.period = 1.0 / rate
+        self.noise = noise
+        self.saccade_rate = saccade_rate
+        self.spread = spread
+        self.break_rate = break_rate
+        self.break_distance = break_distance
+        self.break_dur = break_dur
+        self.rng = np.random.default_rng(seed)
+        self.replay = None if replay is None else load_gaze(replay)
+        self.replay_position = 0
+        self.fixation = np.zeros(2)
+        # last glance away: when it started and where to
+        self.glance_start = -np.inf
+        self.glance_offset = np.zeros(2)
+        self.next_time = None
+        self.messages = []
+
+    def start(self):
+        self.next_time = self.clock.getTime()
+
+    def stop(self):
+        self.next_time = None
+
+    def samples(self):
+        if self.next_time is None:
+            return np.zeros(0, dtype=GAZE_DTYPE)
+        now = self.clock.getTime()
+        n = int((now - self.next_time) / self.period) + 1 if now >= self.next_time else 0
+        samples = np.zeros(n, dtype=GAZE_DTYPE)
+        if n == 0:
+            return samples
+        samples['time'] = self.next_time + np.arange(n) * self.period
+        self.next_time += n * self.period
+
+        if self.replay is not None and len(self.replay):
+            index = (self.replay_position + np.arange(n)) % len(self.replay)
+            self.replay_position = (index[-1] + 1) % len(self.replay)
+            for field in ('x', 'y', 'pupil', 'valid'):
+                samples[field] = self.replay[field][index]
+            return samples
+
+        # fixation points: a new one where a saccade happens, held until the next
+        saccades = self.rng.random(n) < self.saccade_rate * self.period
+        targets = self.rng.normal(0.0, self.spread, (n, 2))
+        targets[0] = np.where(saccades[0], targets[0], self.fixation)
+        held = np.maximum.accumulate(np.where(saccades, np.arange(n), 0))
+        fixations = targets[held]
+        self.fixation = fixations[-1]
+        gaze = fixations + self.rng.normal(0.0, self.noise, (n, 2))
+        if self.break_rate > 0:
+            gaze += self._glances(samples['time'])
+        samples['x'] = gaze[:, 0]
+        samples['y'] = gaze[:, 1]
+        samples['pupil'] = 1000.0
+        samples['valid'] = 1
+        return samples
+
+    def _glances(self, times):
+        # offset of every sample, break_distance away during a glance
+        n = len(times)
+        starts = self.rng.random(n) < self.break_rate * self.period
+        angles = self.rng.uniform(0, 2 * np.pi, n)
+        offsets = self.break_distance * np.column_stack([np.cos(angles), np.sin(angles)])
+        # the glance of every sample = the last one started (or the one
+        # carried over from the call before)
+        offsets = np.concatenate([[self.glance_offset], offsets])
+        start_times = np.concatenate([[self.glance_start], times])
+        held = np.maximum.accumulate(np.where(np.concatenate([[True], starts]),
+                                              np.arange(n + 1), 0))[1:]
+        self.glance_start = start_times[held[-1]]
+        self.glance_offset = offsets[held[-1]]
+        away = times - start_times[held] < self.break_dur
+        return np.where(away[:, None], offsets[held], 0.0)
+
+    def message(self, text):
+        self.messages.append(text)
+
+    def calibrate(self):
+        pass
+
+    def close(self):
+        pass
+
+
+## RECORDING
+class GazeRecorder(object):
+    ''' samples from tracker to one binary file per block, with messages
+
+        data_filename = the session's data file, the gaze files are
+                        <data_filename>_gaze_block<n>.bin and
+                        <data_filename>_gaze_block<n>_messages.tsv
+        capacity = samples the ring buffer holds (it is emptied between
+                   trials, or in a trial when it gets 3/4 full)
+        clock = time stamps of the messages
+    '''
+
+    def __init__(self, tracker, data_filename, capacity=60000, clock=REAL_CLOCK):
+        self.tracker = tracker
+        self.clock = clock
+        self.data_filename = data_filename
+        self.buffer = GazeRingBuffer(capacity)
+        # samples got by the last poll (read by FixationMonitor)
+        self.new_samples = np.zeros(0, dtype=GAZE_DTYPE)
+        self.gaze_file = None
+        self.messages_file = None
+        self.recording = False
+
+    def start_block(self, block_n):
+        self.end_block()
+        path = gaze_file_name(self.data_filename, block_n)
+        # appended to, so a resumed block carries on in the same files
+        self.gaze_file = open(path, 'ab')
+        self.messages_file = open(path[:-len('.bin')] + '_messages.tsv', 'a')
+        self.message('BLOCK %s' % block_n)
+
+    def end_block(self):
+        if self.recording:
+            self.end_trial()
+        if self.gaze_file is not None:
+            self.flush()
+            self.gaze_file.close()
+            self.messages_file.close()
+            self.gaze_file = None
+            self.messages_file = None
+
+    def calibrate(self):
+        self.tracker.calibrate()
+
+    def message(self, text, time=None):
+        if time is None:
+            time = self.clock.getTime()
+        self.tracker.message(text)
+        if self.messages_file is not None:
+            self.messages_file.write('%r\t%s\n' % (time, text))
+
+    def start_trial(self, text):
+        self.tracker.start()
+        self.recording = True
+        self.message('TRIAL_START %s' % text)
+
+    def end_trial(self):
+        self.poll()
+        self.message('TRIAL_END')
+        self.tracker.stop()
+        self.recording = False
+        self.flush()
+
+    def poll(self):
+        if self.recording:
+            self.new_samples = self.tracker.samples()
+            self.buffer.extend(self.new_samples)
+
+    def on_flip(self, phase, t, first):
+        # called by FlipRecorder after every flip
+        self.poll()
+        if first:
+            self.message('PHASE %s' % phase, t)
+        if self.buffer.count > 0.75 * self.buffer.capacity:
+            self.flush()
+
+    def last_sample(self):
+        return self.buffer.last()
+
+    def flush(self):
+        if self.gaze_file is None:
+            return
+        self.buffer.write(self.gaze_file)
+        self.gaze_file.flush()
+        self.messages_file.flush()
+
+    def close(self):
+        self.end_block()
+        self.tracker.close()
+
+
+class NullGaze(object):
+    # no eye tracking, same methods as GazeRecorder
+
+    new_samples = np.zeros(0, dtype=GAZE_DTYPE)
+
+    def start_block(self, block_n):
+        pass
+
+    def end_block(self):
+        pass
+
+    def calibrate(self):
+        pass
+
+    def message(self, text, time=None):
+        pass
+
+    def start_trial(self, text):
+        pass
+
+    def end_trial(self):
+        pass
+
+    def on_flip(self, phase, t, first):
+        pass
+
+    def last_sample(self):
+        return None
+
+    def close(self):
+        pass
+
+
+## FIXATION
+class FixationMonitor(object):
+    ''' is the participant looking at the fixation point?
+
+        gaze = GazeRecorder (or NullGaze, then a trial is never broken)
+        radius = how far the gaze may be from pos (norm units of the height,
+                 x is divided by scale so it is a circle on the screen)
+        tolerance = secs the gaze may be outside the radius (or lost, e.g.
+                    blinks) before the trial counts as broken
+        phases = trial phases that are checked (see UI_timing.PHASES). Once
+                 one has been checked, the gaze is still followed in the
+                 unchecked phases after it (e.g. the blank flip between the
+                 stimulus and the mask) without breaking the trial there, so
+                 a glance away that goes on into the next checked phase
+                 counts from when it started
+
+        Listens to the FlipRecorder after the gaze recorder. broken is set
+        for the rest of the trial once the fixation is broken.
+    '''
+
+    def __init__(self, gaze, radius, tolerance, phases, pos=(0, 0), scale=1.0):
+        self.gaze = gaze
+        self.radius = radius
+        self.tolerance = tolerance
+        self.phases = set(phases)
+        self.pos = pos
+        self.scale = scale
+        self.start_trial()
+
+    def start_trial(self):
+        self.broken = False
+        self.broken_time = None
+        # time the gaze left the radius, None = it is inside
+        self.outside_since = None
+        # a checked phase has been on screen in this trial
+        self.checking = False
+
+    def on_flip(self, phase, t, first):
+        if self.broken:
+            return
+        if phase in self.phases:
+            self.checking = True
+            self.check(self.gaze.new_samples)
+        elif self.checking:
+            # followed, but only a checked phase breaks the trial
+            self.check(self.gaze.new_samples, can_break=False)
+
+    def check(self, samples, can_break=True):
+        if len(samples) == 0:
+            return self.broken
+        dx = (samples['x'] - self.pos[0]) / self.scale
+        dy = samples['y'] - self.pos[1]
+        outside = (dx*dx + dy*dy > self.radius*self.radius) | (samples['valid'] == 0)
+        if not outside.any():
+            self.outside_since = None
+            return self.broken
+        # start time of the run of outside samples every sample is in
+        # (a run going on from the last check keeps its start)
+        times = samples['time']
+        previous = np.concatenate([[self.outside_since is not None], outside[:-1]])
+        run_start = np.where(outside & ~previous, np.arange(len(samples)), 0)
+        run_start = times[np.maximum.accumulate(run_start)]
+        if self.outside_since is not None:
+            continuing = np.logical_and.accumulate(outside)
+            run_start[continuing] = self.outside_since
+        away = outside & (times - run_start >= self.tolerance)
+        if can_break and away.any():
+            self.broken = True
+            self.broken_time = times[np.argmax(away)]
+        self.outside_since = run_start[-1] if outside[-1] else None
+        return self.broken
@@ -0,0 +1,189 @@
+''' MOUSE INPUT for sticky_perception_UI.py
+
+    The trials used to poll myMouse.getPressed() and getWheelRel() once per
+    frame, so a click that started and ended between two flips was never
+    seen and the wheel steps of a frame were added up into one. Here the
+    mouse is an event queue instead: drain() gives every press, release and
+    scroll since the last call, in the order they happened, with their time
+    on the psychopy.core.getTime clock (the same one as win.flip), or the
+    clock they are given (null and scripted, see UI_clock.py).
+
+    iohub    = events come from psychopy.iohub, stamped by the OS when they
+               happened, nothing is lost between frames (default)
+    psychopy = fallback, psychopy.event polled every drain(): presses are
+               stamped when psychopy handles them, a click shorter than a
+               frame can still be missed and wheel steps are per frame
+    null     = no person: every drain() is a left click, right now
+    scripted = events pushed by the program itself (simulations, tests)
+'''
+
+import collections
+
+import psychopy.core
+
+from UI_clock import REAL_CLOCK
+
+
+# one mouse event
+# time = psychopy.core.getTime() of the event
+# kind = PRESS, RELEASE or SCROLL
+# button = LEFT, MIDDLE, RIGHT (None for scrolls)
+# delta = wheel steps of a scroll (0 for presses/releases), same sign as
+#         psychopy's getWheelRel()[1]
+InputEvent = collections.namedtuple('InputEvent', ['time', 'kind', 'button', 'delta'])
+
+PRESS = 'press'
+RELEASE = 'release'
+SCROLL = 'scroll'
+
+# same numbers as psychopy's getPressed()
+LEFT, MIDDLE, RIGHT = 0, 1, 2
+
+INPUT_SOURCES = ['iohub', 'psychopy', 'null', 'scripted']
+
+
+## IOHUB
+class IohubMouseInput(object):
+
+    def __init__(self, io):
+        # io = a running iohub connection (launchHubServer)
+        from psychopy.iohub.constants import EventConstants, MouseConstants
+        self.mouse = io.devices.mouse
+        self.press_types = (EventConstants.MOUSE_BUTTON_PRESS,
+                            EventConstants.MOUSE_DOUBLE_CLICK,
+                            EventConstants.MOUSE_MULTI_CLICK)
+        self.release_type = EventConstants.MOUSE_BUTTON_RELEASE
+        self.scroll_type = EventConstants.MOUSE_SCROLL
+        self.buttons = {MouseConstants.MOUSE_BUTTON_LEFT: LEFT,
+                        MouseConstants.MOUSE_BUTTON_MIDDLE: MIDDLE,
+                        MouseConstants.MOUSE_BUTTON_RIGHT: RIGHT}
+
+    def drain(self):
+        events = []
+        for event in self.mouse.getEvents():
+            if event.type in self.press_types:
+                events.append(InputEvent(event.time, PRESS,
+                                         self.buttons.get(event.button_id), 0))
+            elif event.type == self.release_type:
+                events.append(InputEvent(event.time, RELEASE,
+                                         self.buttons.get(event.button_id), 0))
+            elif event.type == self.scroll_type and event.scroll_dy:
+                events.append(InputEvent(event.time, SCROLL, None, event.scroll_dy))
+        return events
+
+    def clear(self):
+        self.mouse.clearEvents()
+
+
+## PSYCHOPY FALLBACK
+class PsychopyMouseInput(object):
+
+    def __init__(self, mouse):
+        import psychopy.event
+        self.event_module = psychopy.event
+        self.mouse = mouse
+        self.was_pressed = [0, 0, 0]
+
+    def press_time(self, button, since_reset):
+        # psychopy keeps the press time from the last clickReset, on the
+        # clock it was reset with
+        press = self.event_module.mouseClick[button].getLastResetTime() + since_reset
+        return press - psychopy.core.monotonicClock.getLastResetTime()
+
+    def drain(self):
+        events = []
+        pressed, times = self.mouse.getPressed(getTime=True)
+        now = psychopy.core.getTime()
+        for button in (LEFT, MIDDLE, RIGHT):
+            if pressed[button] and not self.was_pressed[button]:
+                events.append(InputEvent(self.press_time(button, times[button]),
+                                         PRESS, button, 0))
+            elif self.was_pressed[button] and not pressed[button]:
+                events.append(InputEvent(now, RELEASE, button, 0))
+        self.was_pressed = list(pressed)
+        scroll = self.mouse.getWheelRel()[1]
+        if scroll:
+            events.append(InputEvent(now, SCROLL, None, scroll))
+        return sorted(events, key=lambda event: event.time)
+
+    def clear(self):
+        self.event_module.clearEvents('mouse')
+        self.mouse.clickReset()
+        self.mouse.getWheelRel()
+        # a button that is still down from before isn't a new press
+        self.was_pressed = list(self.mouse.getPressed())
+
+
+## NO PERSON
+class NullInput(object):
+    # confirms everything straight away, like the null mouse in UI_backend.py
+
+    def __init__(self, clock=REAL_CLOCK):
+        self.clock = clock
+
+    def drain(self):
+        now = self.clock.getTime()
+        return [InputEvent(now, PRESS, LEFT, 0), InputEvent(now, RELEASE, LEFT, 0)]
+
+    def clear(self):
+        pass
+
+
+class ScriptedInput(object):
+    # events put in the queue with push(), drain() only gives the ones whose
+    # time has come
+
+    def __init__(self, clock=REAL_CLOCK):
+        self.clock = clock
+        self.queue = collections.deque()
+
+    def push(self, kind, button=LEFT, delta=0, time=None):
+        if time is None:
+            time = self.clock.getTime()
+        if kind == SCROLL:
+            button = None
+        self.queue.append(InputEvent(time, kind, button, delta))
+
+    def drain(self):
+        now = self.clock.getTime()
+        events = []
+        while self.queue and self.queue[0].time <= now:
+            events.append(self.queue.popleft())
+        return events
+
+    def clear(self):
+        self.queue.clear()
+
+
+def make_input(name, mouse=None, io=None, clock=REAL_CLOCK):
+    ''' input source by name (see INPUT_SOURCES)
+
+        mouse = psychopy Mouse, for 'psychopy'
+        io = iohub connection, for 'iohub' (launched here if None)
+        clock = for 'null' and 'scripted' (the others are always real time)
+    '''
+    if name == 'iohub':
+        if io is None:
+            from psychopy.iohub import launchHubServer
+            io = launchHubServer()
+        return IohubMouseInput(io)
+    elif name == 'psychopy':
+        return PsychopyMouseInput(mouse)
+    elif name == 'null':
+        return NullInput(clock)
+    elif name == 'scripted':
+        return ScriptedInput(clock)
+    raise ValueError('unknown input source %r, must be one of %s'
+                     % (name, INPUT_SOURCES))
+
+
+## READING THE EVENTS
+def first_press(events, button=LEFT, since=None):
+    # first press of button in a list of events, None if there isn't one
+    # since = only presses stamped at or after this time count
+    for event in events:
+        if event.kind == PRESS and event.button == button:
+            if since is not None and event.time < since:
+                continue
+            return event
+    return None
@@ -0,0 +1,90 @@
+''' DYNAMIC NOISE MASK for sticky_perception_UI.py
+
+    The noise between trials (and between the centre change and the
+    reproduction) used to be one random texture that was scrolled a bit every
+    frame. NoiseBank makes a bank of independent noise images from a seed,
+    in a background thread while the instructions are on, and shows a new
+    one every frames_per_image frames. Which image is shown is worked out
+    from the frame number in the phase, and nothing is allocated while it
+    runs.
+'''
+
+import threading
+
+import numpy as np
+
+
+class NoiseBank(object):
+    ''' seeded bank of noise images, cycled frame by frame
+
+        backend, win = see UI_backend.py, the GratingStims are made (in the
+                       main thread, they need the GL context) the first time
+                       the bank is drawn
+        n_images = number of different images, they repeat after
+                   n_images*frames_per_image frames
+        size = images are size x size pixels, values from -1 to 1
+        seed = anything np.random.default_rng takes, same seed = same images
+        background = make the images in a thread (False = straight away)
+    '''
+
+    def __init__(self, backend, win, n_images=60, size=300,
+                 frames_per_image=2, seed=None, background=True):
+        if n_images < 1 or frames_per_image < 1:
+            raise ValueError('n_images and frames_per_image must be at least 1')
+        self.backend = backend
+        self.win = win
+        self.frames_per_image = frames_per_image
+        self.seed = seed
+        self.images = np.empty((n_images, size, size), dtype=np.float32)
+        self.stims = None
+        # image shown last, the next phase carries on from there
+        self.offset = 0
+        self.position = 0
+        self._thread = None
+        self._error = None
+        if background:
+            self._thread = threading.Thread(target=self._generate,
+                                            name='noise bank', daemon=True)
+            self._thread.start()
+        else:
+            self._generate()
+
+    def _generate(self):
+        try:
+            rng = np.random.default_rng(self.seed)
+            for image in self.images:
+                # written in place, -1 to 1
+                rng.random(dtype=np.float32, out=image)
+                image *= 2.0
+                image -= 1.0
+        except Exception as error:
+            # raised again in the main thread by wait()
+            self._error = error
+
+    def wait(self):
+        # until every image is made
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            raise self._error
+
+    def make_stims(self):
+        # one GratingStim per image, made once
+        self.wait()
+        self.stims = [self.backend.visual('GratingStim', self.win, tex=image,
+                                          size=(2,2), units='norm',
+                                          interpolate=False, autoLog=False)
+                      for image in self.images]
+
+    def start(self):
+        # call when a noise phase starts
+        self.offset = self.position
+
+    def draw(self, frame):
+        # draw the image for frame number frame of the phase (from 0)
+        if self.stims is None:
+            self.make_stims()
+        index = self.offset + frame // self.frames_per_image
+        self.stims[index % len(self.stims)].draw()
+        self.position = index + 1
@@ -0,0 +1,105 @@
+''' SIMULATED PARTICIPANT for sticky_perception_UI.py (--simulate)
+
+    SimulatedObserver answers the trials instead of a person: it is the
+    trials' mouse input (drain/clear like the sources in UI_input.py) and
+    listens to the FlipRecorder. At the start of each trial it plans its
+    answers from a response model and hands them out on the frames they
+    happen, so nothing waits for the clock and a whole session runs as fast
+    as the frames can be drawn.
+
+    Response model:
+    uniformity = left click at a random moment of the stimulus, with
+                 p_uniformity (p_uniformity_catch in UI catch trials)
+    RT         = centFill_RT click rt_mean secs after the centre change
+                 (lognormal, sd rt_sd), stamped with that time
+    reproduction = after repro_delay secs, one scroll step every
+                 scroll_frames frames towards the true value (plus
+                 repro_bias and normal noise of sd repro_sd, both in steps),
+                 then a left click repro_confirm secs after the last step
+'''
+
+import numpy as np
+
+from UI_input import InputEvent, PRESS, RELEASE, SCROLL, LEFT
+
+
+class SimulatedObserver(object):
+
+    def __init__(self, frame_period, p_uniformity=0.6, p_uniformity_catch=0.95,
+                 rt_mean=0.45, rt_sd=0.12, repro_bias=0.0, repro_sd=3.0,
+                 repro_delay=0.5, scroll_frames=2, repro_confirm=0.3, seed=None):
+        self.frame_period = frame_period
+        self.p_uniformity = p_uniformity
+        self.p_uniformity_catch = p_uniformity_catch
+        # lognormal with this mean and sd
+        self.rt_sigma = np.sqrt(np.log(1 + (rt_sd / rt_mean)**2))
+        self.rt_mu = np.log(rt_mean) - self.rt_sigma**2 / 2
+        self.repro_bias = repro_bias
+        self.repro_sd = repro_sd
+        self.repro_delay = repro_delay
+        self.scroll_frames = scroll_frames
+        self.repro_confirm = repro_confirm
+        self.rng = np.random.default_rng(seed)
+        # planned answers: {phase: [(secs after the phase onset, kind, delta)]}
+        self.plan = {}
+        self.phase = None
+        self.onset = 0.0
+        self.frames = 0
+
+    def start_trial(self, trial, timeline, repro_start, repro_target, repro_step):
+        ''' plan the answers of a trial
+
+            trial = trial dict (Catch_UI is used)
+            timeline = UI_timing.compile_timeline of the trial
+            repro_start, repro_target, repro_step = value the reproduction
+                starts at, the true value and how much one scroll step changes it
+        '''
+        self.plan = {}
+        p = self.p_uniformity_catch if trial['Catch_UI'] else self.p_uniformity
+        if timeline['stimulus'] and self.rng.random() < p:
+            # read before each stimulus frame but the first
+            frame = self.rng.integers(0, max(timeline['stimulus'] - 1, 1))
+            self.plan['stimulus'] = [(frame * self.frame_period, PRESS, 0)]
+
+        if timeline['centre_change'] is None:
+            rt = self.rng.lognormal(self.rt_mu, self.rt_sigma)
+            self.plan['centre_change'] = [(rt, PRESS, 0)]
+
+        if timeline['reproduction'] is None:
+            steps = (repro_target - repro_start) / repro_step
+            steps = int(round(steps + self.repro_bias + self.rng.normal(0, self.repro_sd)))
+            # scrolling up (negative) makes the value bigger
+            delta = -1 if steps > 0 else 1
+            times = self.repro_delay + np.arange(abs(steps)) * self.scroll_frames * self.frame_period
+            answers = [(t, SCROLL, delta) for t in times]
+            last = times[-1] if len(times) else self.repro_delay
+            answers.append((last + self.repro_confirm, PRESS, 0))
+            self.plan['reproduction'] = answers
+
+    def on_flip(self, phase, t, first):
+        # called by FlipRecorder after every flip
+        if first or phase != self.phase:
+            self.phase = phase
+            self.onset = t
+            self.frames = 0
+        self.frames += 1
+
+    def drain(self):
+        # answers of the current phase that are due by the frame shown last
+        answers = self.plan.get(self.phase)
+        if not answers:
+            return []
+        elapsed = (self.frames - 1) * self.frame_period
+        events = []
+        while answers and answers[0][0] <= elapsed + 1e-9:
+            secs, kind, delta = answers.pop(0)
+            time = self.onset + secs
+            if kind == PRESS:
+                events += [InputEvent(time, PRESS, LEFT, 0), InputEvent(time, RELEASE, LEFT, 0)]
+            else:
+                events.append(InputEvent(time, SCROLL, None, delta))
+        return events
+
+    def clear(self):
+        # answers only come out in their own phase, nothing to throw away
+        pass
@@ -0,0 +1,73 @@
+''' REPRODUCTION TASK CONTROLLER for sticky_perception_UI.py
+
+    The reproduction loop used to add a fixed step to the value for every
+    scroll event and take the step back when it went past a limit, changing
+    the grid once per event. ReproController takes all the mouse events of a
+    frame at once: the scroll steps up to the first left click are added up
+    (each weighted by how fast the wheel was turning), the value is moved once
+    and clipped to its limits, and the grid only has to change once a frame.
+
+    Acceleration: a scroll event coming faster than accel_speed steps per sec
+    (since the scroll before it, also across frames) counts
+    speed / accel_speed times, up to accel_max times. Slow scrolling moves one
+    step per wheel step, as before, a fast flick of the wheel covers the range
+    in fewer turns. accel_max=1 = no acceleration.
+'''
+
+import numpy as np
+
+from UI_input import PRESS, SCROLL, LEFT
+
+
+class ReproController(object):
+    ''' value of the reproduction task, moved by the mouse wheel
+
+        value = where it starts
+        step = change per wheel step, scrolling up (negative delta, like
+               getWheelRel) makes the value bigger
+        low, high = limits, the value never goes past them
+        accel_speed, accel_max = see above
+    '''
+
+    def __init__(self, value, step, low, high, accel_speed=40.0, accel_max=4.0):
+        if low > high:
+            raise ValueError('low must not be bigger than high')
+        if accel_speed <= 0 or accel_max < 1:
+            raise ValueError('accel_speed must be positive and accel_max at least 1')
+        self.value = float(np.clip(value, low, high))
+        self.step = step
+        self.low = low
+        self.high = high
+        self.accel_speed = accel_speed
+        self.accel_max = accel_max
+        # time of the last scroll (NaN = none yet, the first isn't accelerated)
+        self.last_scroll = np.nan
+        self.confirmed = False
+
+    def update(self, events):
+        ''' apply the mouse events of a frame, returns True if the value changed
+
+            events = UI_input.InputEvents in the order they happened, a left
+            click sets confirmed and whatever comes after it is ignored
+        '''
+        scrolls = []
+        for event in events:
+            if event.kind == PRESS and event.button == LEFT:
+                self.confirmed = True
+                break
+            if event.kind == SCROLL and event.delta:
+                scrolls.append((event.time, event.delta))
+        if not scrolls:
+            return False
+
+        times, deltas = np.array(scrolls, dtype=float).T
+        intervals = np.diff(times, prepend=self.last_scroll)
+        self.last_scroll = times[-1]
+        # wheel steps per sec (events with the same time stamp = as fast as it gets)
+        speed = np.abs(deltas) / np.maximum(intervals, 1e-3)
+        gain = np.clip(np.nan_to_num(speed / self.accel_speed, nan=1.0), 1.0, self.accel_max)
+
+        value = np.clip(self.value - self.step * np.dot(deltas, gain), self.low, self.high)
+        changed = bool(value != self.value)
+        self.value = float(value)
+        return changed
@@ -0,0 +1,405 @@
+''' STIMULI SPECS & POOL for sticky_perception_UI.py
+
+    The stimulus lists in the experiment script used to build every
+    ElementArrayStim at import, which meant dozens of GL objects before the
+    first instruction screen. Now the lists only hold StimSpecs (a description
+    of the grid) and the psychopy stimuli are made the first time a trial
+    needs them, through a small pool that throws away the least recently used
+    stimuli when it is full.
+
+    make_stim_coords works out the element positions of a grid. Every set of
+    parameters is only computed once (kept in memory, and in .UI_cache next
+    to this file between sessions) and the same read only array is handed to
+    every grid that asks for it (the null renderer's element arrays use that
+    array as their positions too, see share_coords).
+
+    region_mask marks which elements of a grid are inside a square aperture
+    (the centre) and which are outside (the periphery). A MergedGrid is one
+    element array with both: every phase of a trial is a set of per element
+    colours, sizes and opacities swapped in, so a frame is a single draw
+    instead of a periphery and a centre drawn through a stencil.
+'''
+
+import collections
+import functools
+import hashlib
+import os
+
+import numpy as np
+
+
+## STIMULI COORDINATES
+# grid   = rows and columns (STIM_TYPE 'size' shifts every other row over)
+# hex    = every other row shifted by half a step
+# jitter = grid with every element moved by a random bit (seeded, so the same
+#          params always give the same coords)
+# polar  = rings around the middle of the area
+COORD_LAYOUTS = ['grid', 'hex', 'jitter', 'polar']
+
+# on disk cache of the coords, None = only keep them in memory
+COORD_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               '.UI_cache')
+# change when the layouts change, so old cached coords aren't used
+COORD_CACHE_VERSION = 1
+
+
+def make_stim_coords(STIM_TYPE, x_circles, y_circles, x_start, x_end,
+                     y_start, y_end, layout='grid', jitter=0.25, seed=0):
+    ''' Nx2 array of element positions (normalised), upper left to lower right
+
+        STIM_TYPE = 'size' (every other row shifted over by 0.7 of a step) or
+                    'colour' (not shifted, one more column so the last one
+                    is on x_end)
+        x_circles, y_circles = number of columns and rows
+        x_start, x_end = first and last column (x_end only reached by
+                         'colour', the others stop one step before)
+        y_start, y_end = first row and where the rows stop (not reached)
+        layout = one of COORD_LAYOUTS
+        jitter = for 'jitter', how far an element can move (part of a step)
+        seed = for 'jitter', random seed
+
+        The positions come from np.linspace, so the number of elements is
+        always exact. The array is read only and shared: the same params give
+        back the same array.
+    '''
+    if STIM_TYPE not in ('size', 'colour'):
+        raise ValueError("STIM_TYPE must be 'size' or 'colour'")
+    if layout not in COORD_LAYOUTS:
+        raise ValueError('unknown layout %r, must be one of %s'
+                         % (layout, COORD_LAYOUTS))
+    params = (STIM_TYPE, int(x_circles), int(y_circles), float(x_start),
+              float(x_end), float(y_start), float(y_end), layout,
+              float(jitter), int(seed))
+    return _cached_coords(params)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_coords(params):
+    path = None
+    if COORD_CACHE_DIR is not None:
+        key = hashlib.sha1(repr((COORD_CACHE_VERSION,) + params)
+                           .encode()).hexdigest()[:16]
+        path = os.path.join(COORD_CACHE_DIR, 'coords_%s.npy' % key)
+
+    coords = None
+    if path is not None and os.path.exists(path):
+        try:
+            coords = np.load(path)
+        except (OSError, ValueError):
+            # half written or broken file, just work them out again
+            coords = None
+    if coords is None:
+        coords = _layout_coords(*params)
+        if path is not None:
+            _save_coords(path, coords)
+
+    coords.flags.writeable = False
+    return coords
+
+
+def _save_coords(path, coords):
+    # written to a temporary file first so another session never reads half
+    # a file. A cache that can't be written (read only folder) is not an error
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%i.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as cache_file:
+            np.save(cache_file, coords)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def _layout_coords(STIM_TYPE, x_circles, y_circles, x_start, x_end,
+                   y_start, y_end, layout, jitter, seed):
+    if layout == 'polar':
+        return _polar_coords(x_circles, y_circles, x_start, x_end,
+                             y_start, y_end)
+
+    x_step = (x_end - x_start) / x_circles
+    y_step = (y_end - y_start) / y_circles
+    if STIM_TYPE == 'colour':
+        x_coords = np.linspace(x_start, x_end, x_circles + 1)
+    else:
+        x_coords = np.linspace(x_start, x_end, x_circles, endpoint=False)
+    y_coords = np.linspace(y_start, y_end, y_circles, endpoint=False)
+
+    # column by column, every row of a column after each other (same order as
+    # the meshgrid this used to be)
+    coords = np.empty((len(x_coords), y_circles, 2))
+    coords[:, :, 0] = x_coords[:, None]
+    coords[:, :, 1] = y_coords[None, :]
+
+    # shift of every other row
+    if layout == 'hex':
+        coords[:, 1::2, 0] += 0.5 * x_step
+    elif STIM_TYPE == 'size':
+        coords[:, 1::2, 0] += 0.7 * x_step
+    coords = coords.reshape(-1, 2)
+
+    if layout == 'jitter':
+        rng = np.random.default_rng(seed)
+        coords += (rng.uniform(-jitter, jitter, coords.shape)
+                   * np.abs([x_step, y_step]))
+    return coords
+
+
+def _polar_coords(x_circles, y_circles, x_start, x_end, y_start, y_end):
+    # y_circles rings around the middle of the area, the outer one touching
+    # its edges, with more elements on the bigger rings so they are about as
+    # far apart along every ring (2*x_circles on the outer one)
+    centre = np.array([x_start + x_end, y_start + y_end]) / 2.0
+    radius = np.abs([x_end - x_start, y_end - y_start]) / 2.0
+    rings = []
+    for ring in range(1, y_circles + 1):
+        n = max(int(round(2 * x_circles * ring / y_circles)), 1)
+        angles = np.linspace(0, 2 * np.pi, n, endpoint=False)
+        # start every ring at the top
+        points = np.column_stack([np.sin(angles), np.cos(angles)])
+        rings.append(centre + points * radius * ring / y_circles)
+    return np.concatenate(rings)
+
+
+## CENTRE / PERIPHERY REGIONS
+REGIONS = ['centre', 'periphery']
+
+# (coords, aperture) -> (coords, centre mask, centre coords, periphery
+# coords), the coords are kept so their id can't be reused by another array
+_split_cache = {}
+
+def _split(coords, size, pos):
+    key = (id(coords), tuple(size), tuple(pos))
+    if key not in _split_cache:
+        offset = np.abs(np.asarray(coords) - pos)
+        inside = np.all(offset <= np.asarray(size) / 2.0, axis=1)
+        centre = np.array(coords[inside])
+        periphery = np.array(coords[~inside])
+        for array in (inside, centre, periphery):
+            array.flags.writeable = False
+        _split_cache[key] = (coords, inside, centre, periphery)
+    return _split_cache[key]
+
+
+def region_mask(coords, size, pos=(0, 0)):
+    ''' True for the elements of a grid that are in the centre
+
+        size = (width, height) and pos = (x, y) of the aperture, normalised
+        An element is in the centre if its middle is inside the aperture (on
+        the edge counts as inside). Worked out once per grid and aperture.
+    '''
+    return _split(coords, size, pos)[1]
+
+
+def split_coords(coords, size, pos=(0, 0)):
+    # (centre, periphery) coords of a grid, see region_mask
+    return _split(coords, size, pos)[2:]
+
+
+## STIMULUS SPEC
+# everything needed to build one grid of dots
+# coords = Nx2 array of element positions (normalised)
+# opacity, sizes = single values for every element
+# mask = gaussian blur, circle, other feature if you want
+# orientation = orientation of each element, or 'rand'
+# colour = (R,G,B)
+StimSpec = collections.namedtuple('StimSpec',
+        ['coords', 'opacity', 'sizes', 'mask', 'orientation', 'colour'])
+
+
+def spec_key(spec):
+    # coords are numpy arrays (not hashable), but the same coordinate grid
+    # is shared by all the stimuli that use it (make_stim_coords only makes
+    # each one once), so its id is enough
+    return (id(spec.coords), spec.opacity, spec.sizes, spec.mask,
+            spec.orientation, tuple(spec.colour))
+
+
+## MAKING THE STIMULI
+def make_element_array(backend, win, spec, scale):
+    # backend = see UI_backend.py (real window or null renderer)
+    grid = backend.visual('ElementArrayStim', win, units = None,
+        nElements=len(spec.coords), sizes=spec.sizes,
+        xys=spec.coords, elementTex=None, elementMask = spec.mask)
+
+    share_coords(grid, spec.coords)
+    grid.colorSpace = 'rgb'
+    reset_element_array(grid, spec, scale)
+
+    if spec.orientation == 'rand':
+        # possible orientations from 0 deg to 80 deg
+        rotation = np.arange(0,80,1)
+        # assigns random orientation in range above for each element
+        grid.oris = np.random.choice(rotation, len(spec.coords), replace=True)
+    else:
+        grid.oris = spec.orientation
+
+    return grid
+
+
+def share_coords(grid, coords):
+    # null renderer: the grid keeps the shared (read only) coords themselves
+    # instead of a copy, so moving the elements of one grid (grid.xys += ...)
+    # raises instead of moving every grid on them.
+    # psychopy keeps the copy its xys setter made when the stimulus was built
+    # (there is one element array per merged grid, a copy of the coords each
+    # is not worth going round psychopy's attribute setters for)
+    if not type(grid).__module__.startswith('psychopy'):
+        grid.xys = coords
+
+
+def reset_element_array(grid, spec, scale):
+    # trials change sizes (catch), opacities (catch, reproduction) and colours
+    # (reproduction) so a stimulus coming back out of the pool is set back to
+    # what the spec says
+    grid.colors = list(spec.colour)
+    grid.sizes = spec.sizes
+    grid.sizes *= [scale,1]
+    grid.opacities = spec.opacity
+
+
+## MERGED GRID
+# per element attributes of one phase of a trial
+GridPhase = collections.namedtuple('GridPhase', ['colors', 'sizes', 'opacities'])
+
+
+def grid_key(spec):
+    # specs that can share a merged grid: same elements, mask and orientation
+    return (id(spec.coords), spec.mask, spec.orientation)
+
+
+class MergedGrid(object):
+    ''' one element array with the centre and the periphery of a grid
+
+        stim = the ElementArrayStim (every element of the grid)
+        centre = region_mask of the grid, True = centre element
+        A trial makes a GridPhase per phase with phase(centre=spec,
+        periphery=spec) once, show(phase) swaps it in, set_sizes() and
+        overlay() change it for a frame (catch animation, reproduction).
+        Attributes only go to the element array in draw(), and only the ones
+        that changed.
+    '''
+
+    def __init__(self, stim, centre, scale):
+        self.stim = stim
+        self.regions = {'centre': np.asarray(centre, dtype=bool),
+                        'periphery': ~np.asarray(centre, dtype=bool)}
+        self.scale = scale
+        self.n = len(centre)
+        self.base = None
+        self.colors = np.zeros((self.n, 3))
+        self.sizes = np.zeros((self.n, 2))
+        self.opacities = np.zeros(self.n)
+        self.changed = set()
+
+    def phase(self, centre=None, periphery=None):
+        # GridPhase with the attributes of the centre spec in the centre and
+        # of the periphery spec in the periphery (None = region not shown)
+        colors = np.zeros((self.n, 3))
+        sizes = np.zeros((self.n, 2))
+        opacities = np.zeros(self.n)
+        for region, spec in (('centre', centre), ('periphery', periphery)):
+            if spec is None:
+                continue
+            inside = self.regions[region]
+            colors[inside] = spec.colour
+            sizes[inside] = [spec.sizes * self.scale, spec.sizes]
+            opacities[inside] = spec.opacity
+        for array in (colors, sizes, opacities):
+            array.flags.writeable = False
+        return GridPhase(colors, sizes, opacities)
+
+    def show(self, phase):
+        # draw this phase from now on
+        self.base = phase
+        self.colors[:] = phase.colors
+        self.sizes[:] = phase.sizes
+        self.opacities[:] = phase.opacities
+        self.changed.update(['colors', 'sizes', 'opacities'])
+
+    def set_sizes(self, region, sizes):
+        # sizes = one (width, height) for every element of the region
+        self.sizes[self.regions[region]] = sizes
+        self.changed.add('sizes')
+
+    def overlay(self, region, spec, alpha):
+        ''' spec drawn with opacity alpha over the region of the current phase
+
+            Blended on the CPU ('over' like the window does it), so it looks
+            the same as drawing a second array on top of the first as long as
+            the elements are the same size.
+        '''
+        inside = self.regions[region]
+        base_colors = self.base.colors[inside]
+        base_alpha = self.base.opacities[inside]
+        out_alpha = alpha + base_alpha * (1 - alpha)
+        weight = np.divide(alpha, out_alpha, out=np.ones_like(out_alpha),
+                           where=out_alpha > 0)
+        self.colors[inside] = (weight[:, None] * np.asarray(spec.colour)
+                               + (1 - weight[:, None]) * base_colors)
+        self.opacities[inside] = out_alpha
+        self.changed.update(['colors', 'opacities'])
+
+    def draw(self):
+        if self.changed:
+            if 'colors' in self.changed:
+                self.stim.colors = self.colors
+            if 'sizes' in self.changed:
+                self.stim.sizes = self.sizes
+            if 'opacities' in self.changed:
+                self.stim.opacities = self.opacities
+            self.changed.clear()
+        self.stim.draw()
+
+
+def make_merged_grid(backend, win, spec, scale, aperture_size,
+                     aperture_pos=(0, 0)):
+    # the element array is made like any other grid, the phases set its
+    # attributes before anything is drawn
+    stim = make_element_array(backend, win, spec, scale)
+    return MergedGrid(stim, region_mask(spec.coords, aperture_size,
+                                        aperture_pos), scale)
+
+
+## POOL
+class StimPool(object):
+    ''' bounded pool of materialised stimuli, keyed by spec
+
+        factory(spec) makes a new stimulus, reset(stim, spec) puts a reused one
+        back to its spec values. key(spec) = which specs are the same
+        stimulus (spec_key, or grid_key for merged grids). When more than max_stims are alive the least
+        recently used one is dropped (psychopy frees the GL side when the
+        stimulus is garbage collected).
+    '''
+
+    def __init__(self, factory, reset, max_stims=24, key=spec_key):
+        if max_stims < 1:
+            raise ValueError('max_stims must be at least 1')
+        self.factory = factory
+        self.reset = reset
+        self.key = key
+        self.max_stims = max_stims
+        self._stims = collections.OrderedDict()
+        self.made = 0
+        self.evicted = 0
+
+    def get(self, spec):
+        key = self.key(spec)
+        if key in self._stims:
+            stim = self._stims[key]
+            self._stims.move_to_end(key)
+            self.reset(stim, spec)
+            return stim
+
+        stim = self.factory(spec)
+        self.made += 1
+        self._stims[key] = stim
+        while len(self._stims) > self.max_stims:
+            self._stims.popitem(last=False)
+            self.evicted += 1
+        return stim
+
+    def clear(self):
+        self._stims.clear()
+
+    def __len__(self):
+        return len(self._stims)
@@ -0,0 +1,82 @@
+''' CACHED TEXT SCREENS for sticky_perception_UI.py
+
+    The instruction loops used to call text_screen.setText() and draw the
+    TextBox (and the button text) every frame, so the text was laid out again
+    on every flip. TextCache draws a text once into the back buffer, copies it
+    into a texture (psychopy BufferImageStim) and hands out that image from
+    then on, keyed by the text, the TextBox it is drawn with and the window
+    size. Drawing it is one textured quad per frame.
+
+    Making an image clears the back buffer, so it has to happen before
+    anything else is drawn in a frame: prerender() every screen before the
+    loops that show them (a miss in a loop still works, it is just drawn
+    first).
+'''
+
+from UI_stimuli import StimPool
+
+
+# [left, top, right, bottom] in norm units
+FULL_WINDOW = (-1, 1, 1, -1)
+
+
+def capture(backend, win, stims, rect=FULL_WINDOW):
+    # image of stims drawn in order, only the rect part of the window
+    # (the image is drawn where it was captured)
+    # The stims are drawn here, not handed to BufferImageStim: it only draws
+    # stimuli with a .win and the TextBox doesn't have one, so it would log
+    # "failed to draw" and capture an empty buffer
+    pos = ((rect[0] + rect[2]) / 2.0, (rect[1] + rect[3]) / 2.0)
+    win.clearBuffer()
+    for stim in stims:
+        stim.draw()
+    image = backend.visual('BufferImageStim', win, rect=list(rect), pos=pos,
+                           interpolate=False)
+    win.clearBuffer()
+
+    # the captured pixels (a PIL image, the null renderer has none): every
+    # pixel the same colour = nothing was drawn
+    pixels = getattr(image, 'image', None)
+    if hasattr(pixels, 'getextrema'):
+        extrema = pixels.getextrema()
+        if not isinstance(extrema[0], tuple):
+            # one band images give one (low, high)
+            extrema = [extrema]
+        if all(low == high for low, high in extrema):
+            raise RuntimeError('captured an empty image of %s' % list(stims))
+    return image
+
+
+class TextCache(object):
+    ''' text rendered once, reused across frames and blocks
+
+        backend, win = see UI_backend.py
+        max_screens = images kept at once, the least recently used are
+                      thrown away (a full window image each)
+    '''
+
+    def __init__(self, backend, win, max_screens=16):
+        self.backend = backend
+        self.win = win
+        self.pool = StimPool(self._render, lambda image, spec: None,
+                             max_stims=max_screens, key=self._key)
+
+    def _key(self, spec):
+        textbox, text, rect = spec
+        return (id(textbox), text, tuple(rect), tuple(self.win.size))
+
+    def _render(self, spec):
+        textbox, text, rect = spec
+        textbox.setText(text)
+        return capture(self.backend, self.win, [textbox], rect)
+
+    def get(self, textbox, text, rect=FULL_WINDOW):
+        # image of textbox showing text
+        return self.pool.get((textbox, text, rect))
+
+    def draw(self, textbox, text, rect=FULL_WINDOW):
+        self.get(textbox, text, rect).draw()
+
+    def prerender(self, textbox, texts, rect=FULL_WINDOW):
+        for text in texts:
+            self.get(textbox, text, rect)
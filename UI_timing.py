@@ -0,0 +1,144 @@
+''' FRAME TIMING for sticky_perception_UI.py
+
+    FlipRecorder keeps the timestamp of every win.flip() of a trial, sorted by
+    trial phase, in buffers that are allocated once. At the end of the trial it
+    works out how long each phase really lasted and how many frames were
+    dropped, and the experiment script writes that next to the data row.
+
+    compile_timeline turns the phase durations of a trial into frame counts
+    before it starts, the trial loops then just count frames.
+'''
+
+import numpy as np
+
+from UI_clock import REAL_CLOCK
+
+
+# phases of one trial, in the order they happen
+# blank = the single clearing flips (end of stimulus, end of trial)
+PHASES = ['iti_noise', 'stimulus', 'mask', 'centre_change', 'isi_noise',
+          'reproduction', 'blank']
+
+
+class FlipRecorder(object):
+
+    def __init__(self, frame_period, phases=PHASES, max_flips=4096,
+                 drop_factor=1.5, clock=REAL_CLOCK):
+        self.frame_period = frame_period
+        self.clock = clock
+        self.phases = list(phases)
+        # an interval longer than drop_factor frames means a frame was missed
+        self.drop_factor = drop_factor
+        # flip times, and the interval since the flip before (whatever phase
+        # it was in, so drops at phase changes are counted too)
+        self.buffers = {phase: np.empty(max_flips) for phase in self.phases}
+        self.intervals = {phase: np.empty(max_flips) for phase in self.phases}
+        self.counts = dict.fromkeys(self.phases, 0)
+        self.last_flip = np.nan
+        # objects with on_flip(phase, t, first), called after every flip
+        # (first = first flip of that phase in the trial), e.g. GazeRecorder
+        self.listeners = []
+
+    def start_trial(self):
+        for phase in self.phases:
+            self.counts[phase] = 0
+        # the first flip of a trial has no interval
+        self.last_flip = np.nan
+
+    def record(self, phase, t):
+        n = self.counts[phase]
+        if n == len(self.buffers[phase]):
+            # only happens in very long reproduction phases
+            self.buffers[phase] = np.concatenate(
+                    [self.buffers[phase], np.empty(n)])
+            self.intervals[phase] = np.concatenate(
+                    [self.intervals[phase], np.empty(n)])
+        self.buffers[phase][n] = t
+        self.intervals[phase][n] = t - self.last_flip
+        self.counts[phase] = n + 1
+        self.last_flip = t
+
+    def flip(self, win, phase):
+        t = win.flip()
+        # psychopy only returns the flip time when waiting for the blank
+        if t is None:
+            t = self.clock.getTime()
+        self.record(phase, t)
+        for listener in self.listeners:
+            listener.on_flip(phase, t, self.counts[phase] == 1)
+        return t
+
+    def onset(self, phase):
+        # time of the first flip of a phase in this trial (NaN if none yet)
+        if self.counts[phase] == 0:
+            return np.nan
+        return self.buffers[phase][0]
+
+    def summary(self):
+        # dict of <phase>_flips, _dur, _max_ms, _dropped for every phase
+        # plus the total of dropped frames in the trial
+        row = {}
+        total_dropped = 0
+        for phase in self.phases:
+            n = self.counts[phase]
+            intervals = self.intervals[phase][:n]
+            intervals = intervals[~np.isnan(intervals)]
+            late = intervals[intervals > self.drop_factor * self.frame_period]
+            dropped = int(np.sum(np.round(late / self.frame_period) - 1))
+            total_dropped += dropped
+
+            row[phase + '_flips'] = n
+            if n:
+                times = self.buffers[phase][:n]
+                row[phase + '_dur'] = round(times[-1] - times[0], 5)
+            else:
+                row[phase + '_dur'] = 'NaN'
+            if len(intervals):
+                row[phase + '_max_ms'] = round(1000 * intervals.max(), 3)
+            else:
+                row[phase + '_max_ms'] = 'NaN'
+            row[phase + '_dropped'] = dropped
+        row['Dropped_frames'] = total_dropped
+        return row
+
+    def columns(self):
+        # (name, type) of every value in summary(), like UI_data.DATA_COLUMNS
+        columns = []
+        for phase in self.phases:
+            columns += [(phase + '_flips', int), (phase + '_dur', float),
+                        (phase + '_max_ms', float), (phase + '_dropped', int)]
+        return columns + [('Dropped_frames', int)]
+
+
+def ramp_table(start, end, duration, frame_period):
+    # linear ramp from start to end over duration (secs), one value per frame
+    # (row i = i frames after the start, the last row = end). Computed from
+    # the time of every frame instead of adding a step per frame, so it doesn't
+    # depend on the refresh rate and doesn't build up float error
+    n_frames = int(np.ceil(duration / frame_period)) + 1
+    progress = np.minimum(np.arange(n_frames) * frame_period / duration, 1.0)
+    return start + (end - start) * progress
+
+
+def frame_count(duration, frame_period):
+    # whole number of frames closest to duration (secs), at least 1 unless the
+    # duration is 0
+    if duration <= 0:
+        return 0
+    return max(int(round(duration / frame_period)), 1)
+
+
+def compile_timeline(durations, frame_period):
+    ''' frames of every phase of one trial, worked out before it starts
+
+        durations = {phase: secs}, None = the phase runs until the
+                    participant responds
+        returns {phase: frames} (None stays None), phases that aren't in
+        durations have 0 frames
+    '''
+    timeline = dict.fromkeys(PHASES, 0)
+    for phase, duration in durations.items():
+        if phase not in timeline:
+            raise ValueError('unknown phase %r, must be one of %s' % (phase, PHASES))
+        timeline[phase] = None if duration is None else frame_count(duration, frame_period)
+    return timeline
@@ -0,0 +1,102 @@
+''' TRIAL SEQUENCES for sticky_perception_UI.py
+
+    Builds the exact list of trials a block will run, before the block starts.
+
+    Experimental blocks have two kinds of catch trials:
+    latency catch = a random 1 in latency_catch_every repetitions of every
+                    non catch stimulus runs with the short catch duration
+    UI catch      = the 'Catch' stimuli in the stim lists (illusion forced to
+                    occur). Only the same 1 in latency_catch_every of their
+                    repetitions run, so they make up the same share as the
+                    latency catches.
+    (this used to be done by letting psychopy's TrialHandler run every
+    repetition and skipping 2/3 of the UI catch trials with continue)
+'''
+
+import numpy as np
+
+
+def make_trial_sequence(trial_list, n_reps, rng, method='random',
+                        latency_catch_every=None):
+    ''' list of trials to run, in order.
+
+        trial_list = list of stimulus dicts ({'Trial': {...}})
+        n_reps = repetitions of each stimulus
+        rng = numpy Generator (np.random.default_rng(seed)), so a session
+              can be rebuilt from its seed
+        method = 'random' (shuffled within every repetition, like
+                 TrialHandler) or 'sequential'
+        latency_catch_every = None for practice blocks (no catch trials),
+                              3 for 1 in 3 repetitions, n_reps must divide
+
+        Every trial is a copy of its stimulus dict with 'Trial_index',
+        'Rep_n', 'Trial_Rep_n' (all counted from 1), 'Catch_latency' and
+        'Catch_UI' (0 or 1) and 'Fix_breaks' (0, times the trial was aborted
+        for a broken fixation) added.
+    '''
+    n_types = len(trial_list)
+    is_catch = np.array(['Catch' in trial['Trial']['Condition']
+                         for trial in trial_list], dtype=bool)
+
+    # which repetitions of each stimulus are the catch ones
+    # [stimulus, repetition], exactly n_catch per stimulus
+    if latency_catch_every is None:
+        selected = np.zeros((n_types, n_reps), dtype=bool)
+        is_catch = np.zeros(n_types, dtype=bool)
+    else:
+        if n_reps % latency_catch_every != 0:
+            raise ValueError('n_trials (%i) must be a multiple of %i so every '
+                             'condition gets the same number of catch trials'
+                             % (n_reps, latency_catch_every))
+        n_catch = n_reps // latency_catch_every
+        ranks = rng.random((n_types, n_reps)).argsort(axis=1)
+        selected = ranks < n_catch
+
+    # order of the stimuli within every repetition [repetition, position]
+    if method == 'random':
+        order = rng.random((n_reps, n_types)).argsort(axis=1)
+    elif method == 'sequential':
+        order = np.tile(np.arange(n_types), (n_reps, 1))
+    else:
+        raise ValueError("method must be 'random' or 'sequential'")
+    reps = np.broadcast_to(np.arange(n_reps)[:, None], order.shape)
+
+    # UI catch stimuli only run in their selected repetitions
+    chosen = selected[order, reps]
+    keep = ~is_catch[order] | chosen
+    # position within the repetition, counting only trials that run
+    rep_position = np.cumsum(keep, axis=1)
+
+    sequence = []
+    for index, rep, position, catch in zip(order[keep], reps[keep],
+                                           rep_position[keep], chosen[keep]):
+        trial = dict(trial_list[index])
+        trial['Trial_index'] = int(index) + 1
+        trial['Rep_n'] = int(rep) + 1
+        trial['Trial_Rep_n'] = int(position)
+        trial['Catch_UI'] = int(is_catch[index])
+        trial['Catch_latency'] = int(catch and not is_catch[index])
+        trial['Fix_breaks'] = 0
+        sequence.append(trial)
+    return sequence
+
+
+## SAVING SEQUENCES (session log, see UI_data.SessionLog)
+SEQUENCE_FIELDS = ['Trial_index', 'Rep_n', 'Trial_Rep_n', 'Catch_latency',
+                   'Catch_UI', 'Fix_breaks']
+
+def sequence_to_log(sequence):
+    # only the numbers, the stimuli come back from the stim list
+    return [[trial[field] for field in SEQUENCE_FIELDS] for trial in sequence]
+
+
+def sequence_from_log(logged, trial_list):
+    sequence = []
+    for values in logged:
+        fields = dict(zip(SEQUENCE_FIELDS, values))
+        trial = dict(trial_list[fields['Trial_index'] - 1])
+        trial.update(fields)
+        # logs from before Fix_breaks was logged
+        trial.setdefault('Fix_breaks', 0)
+        sequence.append(trial)
+    return sequence
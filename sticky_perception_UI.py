@@ -17,19 +17,30 @@
     GitHub repository, https://github.com/ninafitzmaurice/Sticky-Perception-Uniformity-Illusion
  '''
 
-import psychopy.visual
-from psychopy.visual import Aperture
-import psychopy.event
-import psychopy.tools
-from psychopy.tools import monitorunittools
-from psychopy import monitors
+import psychopy.core
 import numpy as np
 import random 
+import collections
 from  psychopy.iohub import launchHubServer
 from psychopy import gui
 from psychopy import data
-import pandas as pd
 import os
+import argparse
+from UI_backend import BACKENDS, make_backend
+from UI_clock import CLOCKS, make_clock, Timer
+from UI_timing import FlipRecorder, ramp_table, compile_timeline
+from UI_data import (DATA_COLUMNS, SessionWriter, SessionLog, find_session,
+                     load_session, session_log_name)
+from UI_trials import make_trial_sequence, sequence_to_log, sequence_from_log
+from UI_input import make_input, first_press, LEFT
+from UI_noise import NoiseBank
+from UI_text import TextCache, capture
+from UI_observer import SimulatedObserver
+from UI_reproduction import ReproController
+from UI_eyetracking import (EYETRACKERS, GazeRecorder, IohubTracker,
+                            SimulatedTracker, NullGaze, FixationMonitor)
+from UI_stimuli import (StimSpec, StimPool, make_merged_grid, grid_key,
+                        make_stim_coords, split_coords, share_coords)
 
 # This code runs the uniformity illusion with delayed central stimuli updating
 #### Nina Fitzmaurice thesis project 2022
@@ -40,9 +51,72 @@ import os
 # control = catch trial illusion forced (optional, can be removed) 
 
 
+## COMMAND LINE (optional, running from the psychopy IDE uses the defaults)
+# --backend   window = fullscreen experiment (default)
+#             offscreen = normal psychopy window, no vsync (use xvfb-run if
+#                         there is no display)
+#             null = no rendering at all, runs the whole session without a
+#                    screen, to benchmark the trial loop
+# --participant  skips the participant dialog (needed without a display)
+# --data-dir     where to save the data (default Nina_UI_Data next to this file)
+# --seed         seed for the trial order (default = new random seed, printed)
+# --resume PARTICIPANT  carry on the last session of this participant after
+#                       a crash/quit, from the trial after the last finished one
+# --eyetracker   off = no eye tracking (default)
+#                eyelink = EyeLink through iohub
+#                simulated = made up gaze, no hardware (see UI_eyetracking.py)
+# --gaze-replay FILE  simulated tracker replays this gaze file instead
+# --gaze-breaks RATE  simulated tracker glances away from the cross RATE times
+#                     a sec (breaks the fixation, default 0 = never)
+# --simulate     no person: a simulated participant answers the trials (see
+#                UI_observer.py and observer_model below), the instruction
+#                screens go by on their own and there is no vsync (window =
+#                offscreen). The timelines are worked out for a nominal
+#                simulate_refresh_rate instead of the measured one, so the
+#                frames go by as fast as they are drawn. Prints trials per
+#                sec at the end
+# --clock        real = psychopy time (default)
+#                virtual = null backend only: every flip is exactly one frame
+#                later, no waiting, the same timing every run (UI_clock.py)
+parser = argparse.ArgumentParser(description='Sticky perception uniformity illusion experiment')
+parser.add_argument('--backend', choices=BACKENDS, default='window')
+parser.add_argument('--participant', default=None)
+parser.add_argument('--data-dir', default=None)
+parser.add_argument('--seed', type=int, default=None)
+parser.add_argument('--resume', default=None, metavar='PARTICIPANT')
+parser.add_argument('--eyetracker', choices=EYETRACKERS, default='off')
+parser.add_argument('--gaze-replay', default=None, metavar='FILE')
+parser.add_argument('--gaze-breaks', type=float, default=0.0, metavar='RATE')
+parser.add_argument('--simulate', action='store_true')
+parser.add_argument('--clock', choices=CLOCKS, default='real')
+args, _ = parser.parse_known_args()
+
+if args.simulate:
+    if args.backend == 'window':
+        args.backend = 'offscreen'
+    if args.participant is None and args.resume is None:
+        args.participant = 'simulated'
+
+if args.eyetracker == 'eyelink' and args.backend == 'null':
+    parser.error('the eyelink needs a window, use --eyetracker simulated with the null backend')
+if args.gaze_replay is not None:
+    args.gaze_replay = os.path.abspath(args.gaze_replay)
+
+if args.participant is None and args.resume is None and args.backend != 'window':
+    parser.error('--participant is needed when running with the %s backend' % args.backend)
+
+if args.clock == 'virtual' and args.backend != 'null':
+    parser.error('the virtual clock only works with --backend null')
+
+# time of the flips, mouse events, gaze samples and the instruction demo
+clock = make_clock(args.clock)
+backend = make_backend(args.backend, null_input=args.simulate, clock=clock)
+
 # saves to new folder 'data', new patch to child dir 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 new_dir = current_dir + os.sep + u'Nina_UI_Data'
+if args.data_dir is not None:
+    new_dir = os.path.abspath(args.data_dir)
 # create directory
 if os.path.isdir(new_dir) == False:
     os.mkdir(new_dir)
@@ -54,14 +128,43 @@ print('new dir to save data to:     ', os.getcwd())
 
 experiment_name = 'Uniformity_illusion'
 
-info = {'Participant_nr': 'xxx'}
-dlg = gui.DlgFromDict(dictionary=info, title=experiment_name)
-
-if dlg.OK == False:
-    psychopy.core.quit()
+## RESUMING an interrupted session
+# everything done so far comes from the session log (see UI_data.SessionLog)
+resume = None
+if args.resume is not None:
+    resume = load_session(find_session(new_dir, args.resume, experiment_name))
+    if resume['finished']:
+        print('session of participant %s already finished' % args.resume)
+        psychopy.core.quit()
+    info = resume['info']
+    print('resuming session of %s from %s' % (info['Participant_nr'], info['date']))
+
+else:
+    info = {'Participant_nr': 'xxx'}
+    if args.participant is not None:
+        info['Participant_nr'] = args.participant
+    else:
+        dlg = gui.DlgFromDict(dictionary=info, title=experiment_name)
+        
+        if dlg.OK == False:
+            psychopy.core.quit()
+    
+    info['date'] = data.getDateStr()
+    
+    # RANDOM TRIAL ORDER
+    # seeded so a session's trial sequence can be made again
+    if args.seed is not None:
+        info['seed'] = args.seed
+    else:
+        info['seed'] = int(np.random.SeedSequence().entropy % 2**32)
 
 sub_ID = info['Participant_nr']
-info['date'] = data.getDateStr()
+
+rng = np.random.default_rng(info['seed'])
+if resume is not None and resume['rng_state'] is not None:
+    # carry on from where the last logged trial sequence left the generator
+    rng.bit_generator.state = resume['rng_state']
+print('trial order seed:     ', info['seed'])
 
 filename = '%s_%s_%s.csv' % (info['Participant_nr'], 
             experiment_name, info['date'])
@@ -70,11 +173,6 @@ test_filename = '%s_%s_%s_%s.csv' % (info['Participant_nr'],
             experiment_name,'TEST_', info['date'])
 
 
-# live updating into txt file as back up: 
-# Open a file with access mode 'a'
-# so it can be appended 
-backUp = open(filename+'_backUp.txt', 'a+')
-
 
 ###############################################################
 
@@ -93,24 +191,68 @@ exp_stim_duration = 8
 catch_duration = 2
 # duration of mask (secs)
 mask_duration = 0.1
+# duration of the centre change in blackOut and centFill_Repro blocks (secs)
+# shown for a whole number of frames, the closest to this at the refresh rate
+cent_change_duration = 1.7
 # inter stim noise duration (secs) = for noise btw centre change and REPRODUCTION
 inter_stim_dur = 1
 # inter TRIAL duration (secs) = for noise btwn TRIALS
 inter_trial_dur = 1.5
-
-# number of trials
-# ok this is a mess, I will probably change it later right now I cant be bothered
-# will result in uneven number of control and experimental conditions
-# I dont think its a huge deal?? 
-# IMPORTANT!!! every trial % 3 == 0 will be a SHORT LATENCY CATCH TRIAL
-# ----------------- ONLY FOR NON UI CATCH TRIALS
-# N trials must % 3 == 0!! So 1/3 of trials are short latenct catch trials
+# noise: number of different noise images, and frames each one stays on
+noise_images = 60
+noise_frames_per_image = 2
+
+# number of trials (repetitions of every stimulus in a block)
+# IMPORTANT!!! a random 1 in latency_catch_every repetitions of every stimulus
+# will be a SHORT LATENCY CATCH TRIAL (non UI catch stimuli), and only that
+# many repetitions of the UI catch stimuli are run (see UI_trials.py)
+# N trials must be a multiple of latency_catch_every!! So every condition gets 
+# exactly the same number of catch trials
 n_trials = 9
-if n_trials % 3 != 0:
-    raise Exception("n_trials % 3 MUST = 0!")
+latency_catch_every = 3
+if n_trials % latency_catch_every != 0:
+    raise Exception("n_trials % latency_catch_every MUST = 0!")
 # 16 stimuli to test, so 13/156 = trials per stimuli
 # n_trials /= 16
 
+# data file: rows are written as each trial ends, flushed to disk every
+# data_flush_every trials (0 = only at the end). fsync = make the OS really
+# write it, so a crash loses at most data_flush_every trials
+data_flush_every = 1
+data_fsync = True
+
+# REPRODUCTION TASK: one wheel step changes the size by repro_size_step or the
+# opacity by repro_opacity_step. Scrolling faster than repro_accel_speed steps
+# per sec makes each step count more (in proportion, up to repro_accel_max
+# times), see UI_reproduction.py. repro_accel_max = 1 = always one step
+repro_size_step = 0.002
+repro_opacity_step = 0.02
+repro_accel_speed = 40.0
+repro_accel_max = 4.0
+
+# SIMULATED PARTICIPANT (--simulate), see UI_observer.py
+# the trial timelines are worked out for this refresh rate (not measured)
+simulate_refresh_rate = 60.0
+# uniformity reported in p_uniformity of the trials (p_uniformity_catch of
+# the UI catch trials), RTs lognormal, reproduction errors normal (in scroll steps)
+observer_model = dict(p_uniformity=0.6, p_uniformity_catch=0.95,
+                      rt_mean=0.45, rt_sd=0.12,
+                      repro_bias=0.0, repro_sd=3.0)
+
+# FIXATION CHECK (only with --eyetracker): a trial is aborted and run again
+# later in the block when the gaze is further than fixation_radius (norm,
+# height units) from the cross for more than fixation_tolerance secs in any of
+# fixation_phases. A trial broken fixation_max_breaks times is dropped
+fixation_radius = 0.15
+fixation_tolerance = 0.3
+fixation_phases = ['stimulus', 'mask', 'centre_change']
+fixation_max_breaks = 3
+
+# where the trials get mouse clicks and scrolls from (see UI_input.py)
+# 'iohub' = every event with its OS time stamp, 'psychopy' = polled per frame
+# (also used if iohub doesn't start). Running with --backend null = no person
+input_source = 'iohub'
+
 
 ## SCALE - work out for different aspect ratios
 # I tried to do this automatically but psychopy is annoying so this is how it is
@@ -129,42 +271,62 @@ quit_key = 'q'
 def quit_key_pressed():
     win.close()
 
-psychopy.event.globalKeys.add(quit_key, quit_key_pressed)
+backend.add_global_key(quit_key, quit_key_pressed)
 
 ## WINDOW
-win = psychopy.visual.Window(
+# fullscreen unless running offscreen/null (see --backend)
+win = backend.window(
     #size=[1368, 912],
     size=[1368/2, 912/2],
-    allowStencil=True,
-    units='pix',
-    fullscr=True,
+    allow_stencil=False,
     color=[-1, -1, -1],
-    monitor = monitors.Monitor('samplingExperiment'))
+    monitor_name='samplingExperiment')
 
 
 ####################################################
 
-## Setting up the eyetracker, uncomment if needed 
-#iohub_config = {
-#    'eyetracker.hw.sr_research.eyelink.EyeTracker':{
-#        'name': 'tracker',
-#        'model_name': 'EYELINK 1000 DESKTOP',
-#        'calibration': {
-#            'auto_pace': False,
-#            'screen_background_color': [75,75,75]
-#            },
-#        'runtime_settings': {
-#            'sampling_rate': 500,
-#            'track_eyes': 'RIGHT'
-#            }
-#        
-#        }
-#    }
-#
-#iohub_config['eyetracker.hw.sr_research.eyelink.EyeTracker']['default_native_data_file_name']= ('NINA' + '%s' % (info['Participant_nr']))
-#iohub_config['eyetracker.hw.sr_research.eyelink.EyeTracker']['simulation_mode'] = False
-#io = launchHubServer(window = win, **iohub_config)
-#tracker = io.devices.tracker
+## Setting up the eyetracker (--eyetracker, see UI_eyetracking.py)
+iohub_config = {
+    'eyetracker.hw.sr_research.eyelink.EyeTracker':{
+        'name': 'tracker',
+        'model_name': 'EYELINK 1000 DESKTOP',
+        'calibration': {
+            'auto_pace': False,
+            'screen_background_color': [75,75,75]
+            },
+        'runtime_settings': {
+            'sampling_rate': 500,
+            'track_eyes': 'RIGHT'
+            }
+        
+        }
+    }
+
+iohub_config['eyetracker.hw.sr_research.eyelink.EyeTracker']['default_native_data_file_name']= ('NINA' + '%s' % (info['Participant_nr']))
+iohub_config['eyetracker.hw.sr_research.eyelink.EyeTracker']['simulation_mode'] = False
+
+# one iohub connection for the eyetracker and the mouse events (if they use it)
+io = None
+if args.eyetracker == 'eyelink':
+    io = launchHubServer(window = win, **iohub_config)
+elif input_source == 'iohub' and args.backend != 'null' and not args.simulate:
+    # (--simulate: the simulated participant is the mouse, nothing reads iohub)
+    try:
+        io = launchHubServer(window = win)
+    except Exception as error:
+        print('iohub did not start (%s)' % error)
+
+# gaze samples go to <data file>_gaze_block<n>.bin, one file per block
+if args.eyetracker == 'eyelink':
+    tracker = IohubTracker(io.devices.tracker, win.size)
+    gaze = GazeRecorder(tracker, filename, clock=clock)
+elif args.eyetracker == 'simulated':
+    tracker = SimulatedTracker(replay=args.gaze_replay, break_rate=args.gaze_breaks,
+                               seed=np.random.SeedSequence(info['seed']).spawn(2)[1],
+                               clock=clock)
+    gaze = GazeRecorder(tracker, filename, clock=clock)
+else:
+    gaze = NullGaze()
 
 #################################################################
 
@@ -173,83 +335,74 @@ win = psychopy.visual.Window(
 # I think 
 win.units = 'norm' 
 
+## FRAME RATE
+# measured once, psychopy returns None if it can't get a stable measure
+# --simulate: nominal, the offscreen window doesn't wait for the vertical
+# blank so the measure would be how fast it can flip. With a fixed rate every
+# phase is a fixed number of frames that go by as fast as they are drawn
+if args.simulate:
+    refresh_rate = simulate_refresh_rate
+else:
+    refresh_rate = win.getActualFrameRate()
+if refresh_rate is None:
+    refresh_rate = 60.0
+frame_period = 1.0/refresh_rate
+print('refresh rate:     ', refresh_rate)
+
+# records every flip in RUN_TRIALS (see UI_timing.py)
+# the gaze recorder gets the samples and marks the phases on every flip
+flips = FlipRecorder(frame_period, clock=clock)
+flips.listeners.append(gaze)
+# then the fixation is checked with the new samples
+fixation = FixationMonitor(gaze, fixation_radius, fixation_tolerance,
+                           fixation_phases, pos=(0,0), scale=scale)
+flips.listeners.append(fixation)
+
 ## MOUSE
-myMouse = psychopy.event.Mouse(visible=True)
+myMouse = backend.mouse(visible=True)
 # [0] = left, [1] = wheel in the middle is pressed, [2], right
 # leftClick, wheelClick, rightClick = myMouse.getPressed()
+# (only the instruction screens poll it, the trials use the event queue below)
+
+## MOUSE EVENTS for the trials
+observer = None
+if args.simulate:
+    # answers every trial, reads the frames like the gaze recorder
+    # (scrolls slower than repro_accel_speed, its answers are in single steps)
+    observer = SimulatedObserver(frame_period, seed=np.random.SeedSequence(info['seed']).spawn(4)[3],
+                                 scroll_frames=max(2, int(np.ceil(1.0 / (frame_period * repro_accel_speed)))),
+                                 **observer_model)
+    flips.listeners.append(observer)
+    mouse_input = observer
+elif args.backend == 'null':
+    mouse_input = make_input('null', clock=clock)
+else:
+    try:
+        if input_source == 'iohub' and io is None:
+            raise RuntimeError('no iohub connection')
+        mouse_input = make_input(input_source, mouse=myMouse, io=io)
+    except Exception as error:
+        print('mouse input %r did not start (%s), polling with psychopy' % (input_source, error))
+        mouse_input = make_input('psychopy', mouse=myMouse)
 
 ## APERTURE:
+# the area of the centre stimuli, every element of a grid belongs to the
+# centre (inside) or the periphery (outside), see UI_stimuli.region_mask
+# (no psychopy Aperture/stencil, nothing is switched while drawing)
 # experimental only 
-aperture = psychopy.visual.Aperture(win, size= (0.97,1), pos=(0,0), shape='square', 
-    inverted=False, units=None)
-    
+aperture_size = (0.97,1)
+aperture_pos = (0,0)
 # for demo only
-demo_aperture = psychopy.visual.Aperture(win, size= (0.3,0.3), pos=(0,-0.475), shape='square', 
-    inverted=False, units=None)
-
-
-# aperture should be off initially 
-aperture.enabled = False
-demo_aperture.enabled = False
+demo_aperture_size = (0.3,0.3)
+demo_aperture_pos = (0,-0.475)
 
 
 ####### STIMULI COORDINATES
-
-def make_stim_coords(STIM_TYPE, x_circles, y_circles, x_start, x_end, y_start, y_end):
-    # normalisation = length of x, y = 2
-    # set step size from point x/y start to x/y end
-    x_len =  abs(x_start) + abs(x_end)
-    #print('x len: ',x_len)
-    # if negative y start coord, then convert both to pos values and 
-    # subract smaller from bigger (to get distance between points)
-    if y_start < 0:
-        y_len =  round(abs(y_end) - abs(y_start), 1)
-        
-    elif y_start > 0 and y_end < 0:
-        y_len = round(y_start + abs(y_end), 1)
-    
-    #print('y len ', y_len)
-    
-    x_step = x_len/x_circles
-    y_step = y_len/y_circles
-    
-    # coords for circles, upper left to lower right
-    if STIM_TYPE == 'colour':
-        x_coords = np.array(np.arange(x_start, x_end + x_step, x_step))
-        y_coords = np.array(np.arange(y_start, y_end, -1*y_step))
-    else: 
-        x_coords = np.array(np.arange(x_start, x_end, x_step))
-        y_coords = np.array(np.arange(y_start, y_end, -1*y_step))
-    #print(x_coords)
-    #print(y_coords)
-    # makes coordinate grid
-    coords = np.array(np.meshgrid(x_coords, y_coords)).T.reshape(-1, 2)
-    
-    if STIM_TYPE == 'size':
-        # for the shift of rows.......
-        x = np.empty((x_circles)) # number of rows (y coords in meshgrid)
-        x[::2] = 0 # for every odd row = every x coord is 0
-        x[1::2] = 0.7* x_step # for every odd row = every x coord is half x step
-        y = np.zeros((y_circles)) # for every instance of x, the y coord is 0 
-        
-        # formatt in same way as coords 
-        shift = np.array(np.meshgrid(y, x)).T.reshape(-1, 2)
-        shift = np.fliplr(shift)
-        
-        # add n to every x coord on the yth row
-        coords_shifted = shift + coords
-        
-        # dots will be shifted over!! 
-        
-        return coords_shifted
-    
-    elif STIM_TYPE == 'colour':
-        # dots will NOT be shifted over!! 
-        return coords
-    
+# see make_stim_coords in UI_stimuli.py
 
 ## TO CUSTOMISE 
 # args: STIM_TYPE, x_circles, y_circles, x_start, x_end, y_start, y_end
+# optional: layout = 'grid' (default), 'hex', 'jitter' or 'polar'
 
 # STIM_TYPE = for size or colour stim
 #   size stim = coords will be shifted 
@@ -261,6 +414,7 @@ def make_stim_coords(STIM_TYPE, x_circles, y_circles, x_start, x_end, y_start, y
 # values are normalised!!
 
 # coordinates for the mini demo in instructions
+# (the same params give back the same array, it is only worked out once)
 coords_demo_periph = make_stim_coords('colour', 10,8,-0.3,0.3,-0.2,-0.75)
 coords_demo_cent = make_stim_coords('colour', 10,8,-0.3,0.3,-0.2,-0.75)
 
@@ -272,9 +426,10 @@ coords_size = make_stim_coords('size', 18,12,-0.95,0.975,0.95,-1.05)
 ## DEMO ELEMENT ARRAY
 # makes a grid of dots like the experimental stimuli but with fewer params
 def demo_stimuli_grid(coords, size, R,G,B):
-    grid = psychopy.visual.ElementArrayStim(win, units = None,
+    grid = backend.visual('ElementArrayStim', win, units = None,
     nElements=len(coords), sizes=size,
     xys=coords, elementTex=None, elementMask = 'circle')
+    share_coords(grid, coords)
     
     grid.colors = [R,G,B]
     grid.sizes *= [scale,1]
@@ -282,8 +437,14 @@ def demo_stimuli_grid(coords, size, R,G,B):
     return grid
 
 ## DEMO STIMULI can customise 
-demo_cent = demo_stimuli_grid(coords_demo_periph, 0.045,0,1,0)
-demo_periph = demo_stimuli_grid(coords_demo_cent, 0.045,1,0,0)
+# cent = green centre, periph = red periphery, fill = red centre (centre
+# change), overlay = green periphery (reproduction overlay)
+demo_centre_coords, demo_periph_coords = split_coords(coords_demo_cent, 
+                                                      demo_aperture_size, demo_aperture_pos)
+demo_cent = demo_stimuli_grid(demo_centre_coords, 0.045,0,1,0)
+demo_periph = demo_stimuli_grid(demo_periph_coords, 0.045,1,0,0)
+demo_fill = demo_stimuli_grid(demo_centre_coords, 0.045,1,0,0)
+demo_overlay = demo_stimuli_grid(demo_periph_coords, 0.045,0,1,0)
 
 
 ## STIMULI ELEMENT ARRAY
@@ -294,38 +455,25 @@ demo_periph = demo_stimuli_grid(coords_demo_cent, 0.045,1,0,0)
 # RGB = colour 
 # orientation = orientation of each element 
 def stimuli_grid(coordinates, opacity, sizes, mask, orientation, R,G,B):
-    
-    grid = psychopy.visual.ElementArrayStim(win, units = None,
-        nElements=len(coordinates), sizes=sizes,
-        xys=coordinates, elementTex=None, elementMask = mask)
-    
-    grid.colors = [R,G,B]
-    grid.colorSpace='rgb'
-    grid.sizes *= [scale,1]
-    
-    grid.opacities = opacity
-    
-    if orientation == 'rand': 
-        # possible orientations from 0 deg to 80 deg
-        rotation = np.arange(0,80,1)
-        # assigns random orientation in range above for each element 
-        grid.oris = np.random.choice(rotation, len(coords_shifted), replace=True)
-    else:
-        grid.oris = orientation
+    # only describes the grid! the ElementArrayStim is made by the stimuli
+    # pool the first time a trial uses it (see UI_stimuli.py)
     
     # I removed fringe width because it wasn't blury enough, but code is here incase
     # change of mind or someone wants to use it
 #    if mask == 'raisedCos':
 #        grid.maskParams = {'fringeWidth': fw}
     
-    return grid
+    return StimSpec(coordinates, opacity, sizes, mask, orientation, (R,G,B))
 
 
 ## NOISE
-noiseTexture = np.random.rand(300, 300) * 2.0 - 1
-noise = psychopy.visual.GratingStim(win, tex=noiseTexture,
-        size=(2,2), units='norm',
-        interpolate=False, autoLog=False)
+# dynamic noise, a new image every noise_frames_per_image frames from a bank of
+# noise_images seeded images (see UI_noise.py). The bank is made in the
+# background while the instructions are on. Its seed comes from the session
+# seed, but it doesn't use up any of the trial order random numbers
+noise = NoiseBank(backend, win, n_images=noise_images,
+                  frames_per_image=noise_frames_per_image,
+                  seed=np.random.SeedSequence(info['seed']).spawn(1)[0])
 
 
 ## STIMULI VALUES
@@ -500,7 +648,7 @@ centFill_stim_list = [
 #                        'Condition': ['Exp', '001'],
 #                        'Name': 'Ori'}},
 
-#            # Donuts
+#            # Donuts (the trial code for these has been taken out of RUN_TRIALS)
 #            # centre donut periph circle
 #            {'Trial': {'Cent': stimuli_grid(1,0.07,'circle',0,1,1,1),
 #                        'Cent_2': stimuli_grid(1,0.03,'circle',0,0,0,0),
@@ -589,9 +737,30 @@ blackOut_stim_list = [
                         ]
 
 
+## STIMULI POOL
+# one merged grid (a single element array with the centre and the periphery)
+# for all the stimuli on the same coordinates, made the first time a trial
+# uses it. The trial phases set all its colours, sizes and opacities (see
+# MergedGrid in UI_stimuli.py), so a reused grid needs no reset, and there
+# is room for every grid the stimuli lists use (one per coords, mask and
+# orientation), so none is ever thrown away
+grid_keys = set(grid_key(stim['Trial']['Cent'])
+                for stim_list in (CF_test_stim_list, BO_test_stim_list,
+                                  centFill_stim_list, blackOut_stim_list)
+                for stim in stim_list)
+stim_pool = StimPool(lambda spec: make_merged_grid(backend, win, spec, scale,
+                                                   aperture_size, aperture_pos),
+                     lambda grid, spec: None,
+                     max_stims=len(grid_keys), key=grid_key)
+
+def trial_grid(trial):
+    # materialise (or reuse) the merged grid of the trial's stimuli
+    return stim_pool.get(trial['Trial']['Cent'])
+
+
 ## TEXT STIM & FIXATION & BUTTONS
 
-text_screen = psychopy.visual.TextBox(win,
+text_screen = backend.visual('TextBox', win,
                          text='q',
                          font_size=32,
                          font_color=[1,1,1],
@@ -601,7 +770,7 @@ text_screen = psychopy.visual.TextBox(win,
                          units='norm'
                          )
 
-fix = psychopy.visual.TextStim(win, text='+', pos=0, color=[1,1,1],
+fix = backend.visual('TextStim', win, text='+', pos=0, color=[1,1,1],
                                 colorSpace ='rgb', opacity=0.5, units='norm', 
                                 height=0.09)
 
@@ -687,77 +856,45 @@ to submit choice '''
 
 def RUN_TRIALS(trials, block, blockNumber, trialNumber):
     # SEND MESSAGE TO EYE TRACKER
-    # tracker.sendMessage(f'''block {block} {blockNumber} starts''')
+    gaze.message(f'''block {block} {blockNumber} starts''')
     
     ### LATENCY & UI CATCH TRIALS
-    '''MESS MESS MESS - I will change this at some point
-    for now its ok
-    
-    making sure that a random 1/3 of all trials are latency catch
-     and that 1/3 of the UI catch trials are run rather than all of them
-     NOTE = it is set up this way because the UI catch trials are in the stimuli
-           dicts (stim_lists) but the latency catches are not. 
-           UI catch must also be 1/3 of trials or the trial split would
-           not be even. 
-           this code will make sure only a random 1/3 of UI catch trials run!
+    # trials = the exact list of trials to run, catch trials already picked
+    # and marked by make_trial_sequence (see UI_trials.py)
     
-     1. make dict with all trial indexes as the keys
-     2. randomly select 1/3 of trials from each index and 
-        add this random 1/3rd of trials to the dict.
-        i.e.     dict = {'1':[2,4,7],'2':[5,11,3]...}'''
-    catch_reps = {}
-    # if not trial blocks...
-    if blockNumber != 'NaN':
-        # for every trial type in the stim list 
-        for i in range(1,len(trials.trialList)+1): 
-            # add trial index as a key in the dict
-            if i not in catch_reps:
-                # for each index that is not in the list, make a new key
-                # and append random 1/3 of trials to that list
-                catch_reps[i] = np.random.choice(np.arange(1,n_trials+1), 
-                                                        int(n_trials/3), replace=False)
+    ### CATCH RAMP TABLES
+    # the whole catch animation, one row per frame, worked out once per block
+    # so the frame loop only has to look up the value for the current frame
+    # UI catch trials always run for exp_stim_duration
+    # Size = periphery grows from small to big (already scaled, Nx2 ready)
+    # Colour = opacity of the second periphery from 0 (fully transparent) to 1
+    catch_tables = {}
+    for trial_type in trials:
+        name = trial_type['Trial']['Name']
+        if not trial_type['Catch_UI'] or name in catch_tables:
+            continue
+        if name == 'Size':
+            catch_tables[name] = np.outer(ramp_table(small, big, exp_stim_duration, frame_period), [scale,1])
+        elif name == 'Colour':
+            catch_tables[name] = ramp_table(0, 1, exp_stim_duration, frame_period)
     
-    skipped_counter = 0
-    
-    for trial in trials:
-        #tracker.setRecordingState(True)
+    # trials still to run, aborted trials go back in (see requeue_trial)
+    queue = collections.deque(trials)
+    while queue:
+        trial = queue.popleft()
         
         # 1. setting up trial....
+        # everything saved about this trial, written to the data file at the end
+        row = {}
             
         # 1.a.
-        # organising number of trials that are catch trials
-        ## LATENCY & UI CATCH TRIALS NEW VERSION
-        # 2/3rds of trials are a latency or UI catch 
-        # excluding trial blocks 
-        # part of the aforementioned mess
-        if blockNumber != 'NaN':
-            if 'Catch' in trial['Trial']['Condition']:
-                # if thisRepN in dict[trial index]
-                #        this rep N is saved to dict as a catch trial
-                if trials.thisRepN+1 in catch_reps.get(trials.thisIndex+1):
-                    stim_duration = exp_stim_duration
-                    data['Catch_latency'].append(0)
-                    
-                elif trials.thisRepN+1 not in catch_reps.get(trials.thisIndex+1):
-                    skipped_counter += 1
-                    #print('SKIPPED ',trials.thisN, trial['Trial']['Condition'])
-                    #trials.next()
-                    #print('trial n before continue: ', trials.thisN)
-                    continue
-                    
-            elif 'Catch' not in trial['Trial']['Condition']:
-                # LATENCY CATCH
-                if trials.thisRepN+1 in catch_reps.get(trials.thisIndex+1):
-                    stim_duration = catch_duration
-                    data['Catch_latency'].append(1)
-                    
-                elif trials.thisRepN+1 not in catch_reps.get(trials.thisIndex+1):
-                    stim_duration = exp_stim_duration
-                    data['Catch_latency'].append(0)
-                    
+        # latency catch trials are shorter, everything else (incl. UI catch)
+        # runs for the normal duration
+        if trial['Catch_latency']:
+            stim_duration = catch_duration
         else:
             stim_duration = exp_stim_duration
-            data['Catch_latency'].append(0)
+        row['Catch_latency'] = trial['Catch_latency']
             
 #-----------------------------------------------------------------------
 #          ignore 
@@ -783,392 +920,372 @@ def RUN_TRIALS(trials, block, blockNumber, trialNumber):
 #            data['Catch_latency'].append(0)
 #--------------------------------------------------------------------
         
-        # ONLY THE TRIALS RAN!!
         trialNumber += 1
         
         ## saving trial related data 
         # sub ID
-        data['Sub_ID'].append(sub_ID)
-        # +1 bc python indexing starts at 0
-        # rep number
-        data['Rep_n'].append(trials.thisRepN+1)
+        row['Sub_ID'] = sub_ID
+        # rep number (counted from 1)
+        row['Rep_n'] = trial['Rep_n']
         # block number
-        data['Block_n'].append(blockNumber)
+        row['Block_n'] = blockNumber
         # block type (centFill or blackOut or test)
-        data['Block_type'].append(block)
+        row['Block_type'] = block
         # trial number out of total trials 
-        data['Trial_n'].append(trialNumber)
+        row['Trial_n'] = trialNumber
         # trial number out of current repeat
-        data['Trial_Rep_n'].append(trials.thisTrialN+1)
+        row['Trial_Rep_n'] = trial['Trial_Rep_n']
         # index of trial 
-        data['Trial_index'].append(trials.thisIndex+1)
+        row['Trial_index'] = trial['Trial_index']
         # the name of the stimuli group 
-        data['Stimuli'].append(trial['Trial']['Name'])
+        row['Stimuli'] = trial['Trial']['Name']
         # more details about the stimuli condition in string 
-        data['Condition'].append(trial['Trial']['Condition'])
+        row['Condition'] = trial['Trial']['Condition']
         
         # these values are saved to compare the reproduction task values to
         # colour = compare repro opacity to actual opacity (100% opace)
         if trial['Trial']['Name'] == 'Colour':
-            data['Cent_opacity'].append(1)
+            row['Cent_opacity'] = 1
         else:
             # not import for size trials
-            data['Cent_opacity'].append('NaN')
+            row['Cent_opacity'] = 'NaN'
         
         # compare the repro values to these values
         # these values match the centre values for each stimuli
         if trial['Trial']['Name'] == 'Size': 
             if 'Cent_small' in trial['Trial']['Condition']:
-                data['Cent_size'].append(big)
+                row['Cent_size'] = big
                 
             elif  'Cent_big' in trial['Trial']['Condition']:
-                data['Cent_size'].append(small)
+                row['Cent_size'] = small
                 
             elif 'no_UI' in trial['Trial']['Condition']:
-                data['Cent_size'].append(0.03)
+                row['Cent_size'] = 0.03
                 
             elif 'Catch' in trial['Trial']['Condition']:
-                data['Cent_size'].append(big)
+                row['Cent_size'] = big
         else:
-            data['Cent_size'].append('NaN')
+            row['Cent_size'] = 'NaN'
             
         
         if 'Exp' in trial['Trial']['Condition']:
-            data['Exp'].append(1)
+            row['Exp'] = 1
         else:
-            data['Exp'].append(0)
+            row['Exp'] = 0
         
-        if 'Catch' in trial['Trial']['Condition']:
-            data['Catch_UI'].append(1)
-        else:
-            data['Catch_UI'].append(0)
-        
-        
-        ### INIT PARAMS FOR CATCH TRIALS
-        radius_catch = small
-        # the size of the inner circle is set to 0 in catch trial
-        radius_catch_donut = 0
-        # set opacity catch to 0 == fully transparent, will increase to 1! 
-        opacities_catch = 0
+        row['Catch_UI'] = trial['Catch_UI']
         
         
+        ### STIMULI FOR THIS TRIAL
+        # one merged grid (made on first use, reused from the pool) and the
+        # colours, sizes and opacities of every element in each phase
+        grid = trial_grid(trial)
+        specs = trial['Trial']
+        phases = {'stimulus': grid.phase(centre=specs['Cent'], periphery=specs['Periph']),
+                  'centre_change': grid.phase(centre=specs['Cent_new'], periphery=specs['Periph'])}
+        if 'Catch' in trial['Trial']['Condition'] and trial['Trial']['Name'] == 'Size':
+            # the periphery stays as big as the catch ramp left it
+            # (last row of the table = big), it doesn't go back to Periph
+            catch_size = catch_tables['Size'][-1][1]
+            phases['centre_change'] = grid.phase(centre=specs['Cent_new'],
+                                                 periphery=specs['Periph']._replace(sizes=catch_size))
+
         ### INIT REPRODUCTION TASK VALUES
+        # Size = only the repro grid in the periphery, the value is its size
+        # Colour = repro colour over the periphery, the value is its opacity
+        repro_spec = specs['Repro']
         if trial['Trial']['Name'] == 'Size':
-            trial['Trial']['Repro'].setSizes(repro_size)
-            trial['Trial']['Repro'].sizes *= [scale,1]
+            phases['reproduction'] = grid.phase(periphery=repro_spec)
+            # limits = big and small stimuli +/-0.005 (bit of overshoot)
+            repro = ReproController(repro_size, repro_size_step, small - 0.005, big + 0.005,
+                                    repro_accel_speed, repro_accel_max)
             
         if trial['Trial']['Name'] == 'Colour':
             if '010' in trial['Trial']['Condition']:
-                trial['Trial']['Repro'].colors = [0,1,0]
+                repro_spec = repro_spec._replace(colour=(0,1,0))
             if '001' in trial['Trial']['Condition']:
-                trial['Trial']['Repro'].colors = [0,0,1]
+                repro_spec = repro_spec._replace(colour=(0,0,1))
             if '101' in trial['Trial']['Condition']:
-                trial['Trial']['Repro'].colors = [1,0,1]
+                repro_spec = repro_spec._replace(colour=(1,0,1))
+            phases['reproduction'] = grid.phase(periphery=specs['Periph'])
+            repro = ReproController(repro_spec.opacity, repro_opacity_step, 0, 1,
+                                    repro_accel_speed, repro_accel_max)
         
-        timer = psychopy.core.Clock() # sets a clock for each trial 
+        ### TIMELINE of this trial, in frames at the measured refresh rate
+        # every phase below runs for exactly this many flips (None = until the
+        # participant clicks), there are no clock reads while it runs
+        timeline = compile_timeline({
+            'iti_noise': inter_trial_dur,
+            'stimulus': stim_duration,
+            'mask': mask_duration,
+            # centFill_RT: until the click, no noise and no reproduction
+            'centre_change': None if block == 'centFill_RT' else cent_change_duration,
+            'isi_noise': 0 if block == 'centFill_RT' else inter_stim_dur,
+            'reproduction': None if block != 'centFill_RT' else 0}, frame_period)
+        
+        # the simulated participant plans its answers (in scroll steps of
+        # the reproduction task)
+        if observer is not None:
+            if trial['Trial']['Name'] == 'Size':
+                observer.start_trial(trial, timeline, repro.value, row['Cent_size'], repro.step)
+            else:
+                observer.start_trial(trial, timeline, repro.value, row['Cent_opacity'], repro.step)
+        
+        flips.start_trial()
+        fixation.start_trial()
+        
+        ## EYE TRACKER RECORDING FOR THIS TRIAL
+        # every phase is marked in the gaze messages on its first flip
+        gaze.start_trial(f'''trial index: {trial['Trial_index']}. trial n: {trialNumber}, rep: {trial['Rep_n']}, block: {block}''')
         
 
         # NOISE BEFORE EACH TRIAL TO CLEAR EFFECTS OF LAST TRIAL
-        while timer.getTime()<inter_trial_dur:
-                # remove apature 
-                aperture.enabled = False
-                noise.phase += (0.01 / 2, 0.005 / 2)
-                noise.draw()
-                win.flip()
-                if timer.getTime()>inter_trial_dur:
-                    break
+        noise.start()
+        for frame in range(timeline['iti_noise']):
+            noise.draw(frame)
+            flips.flip(win, 'iti_noise')
         
-        # SEND MESSAGE TO EYE TRACKER
-        #tracker.sendMessage(f'''UI: trial index: {trials.thisIndex}. trial n: {trialNumber}, rep: {trials.thisRepN+1}, block: {block}''')
         # 2. running trials...
-        myMouse.clickReset()
+        mouse_input.clear()
         UI_was_seen = False
+        # periphery and centre stimuli
+        grid.show(phases['stimulus'])
         
-        while timer.getTime()<stim_duration:
+        for frame in range(timeline['stimulus']):
             
-            # to report seeing UI 
-            mouseClicks = myMouse.getPressed()
-            if mouseClicks[0]==1:
+            # to report seeing UI (any left click since the last frame)
+            if first_press(mouse_input.drain(), LEFT) is not None:
                 UI_was_seen = True
-        
-            # draw peripheral stimuli
-            aperture.enabled = True
-            aperture.inverted= True
             
             # this will select UI CATCH TRIALS (UI forced to occur)
             if 'Catch' in trial['Trial']['Condition']:
+                # row of the ramp table for this frame of the stimulus
+                catch_table = catch_tables[trial['Trial']['Name']]
                 
                 if trial['Trial']['Name'] == 'Size':
-                    # speed(steps) = distance/time
-                    # distance = big-small
-                    # time = stim duration
-                    radius_catch += ((big-small)/(stim_duration*60))
-                    trial['Trial']['Periph'].sizes = radius_catch
-                    trial['Trial']['Periph'].sizes *= [scale,1]
-                    trial['Trial']['Periph'].draw()
-                
-                elif trial['Trial']['Name'] == 'Donut':
-                    # speed(steps) = distance/time
-                    # distance = from 0 to 0.03
-                    # time = stim duration
-                    trial['Trial']['Periph'].draw()
-                    radius_catch_donut += (0.03/(stim_duration*60))
-                    trial['Trial']['Periph_2'].sizes = radius_catch_donut
-                    trial['Trial']['Periph_2'].sizes *= [scale,1]
-                    trial['Trial']['Periph_2'].draw()
+                    # periphery grows from small to big over the stim duration
+                    grid.set_sizes('periphery', catch_table[frame])
                     
                 elif trial['Trial']['Name'] == 'Colour':
-                    trial['Trial']['Periph'].draw()
-                    # this will slowly increase the opacity of the second periphery:
-                    # same values as centre and repro
-                    opacities_catch += (1/(stim_duration*60)) # from one to 0 over the duration of the stimuli
-                    trial['Trial']['Catch'].opacities = opacities_catch
-                    trial['Trial']['Catch'].draw()
-            
-            # draw the double periph stimuli for donut condition
-            elif 'Exp' and 'Periph_donut' in trial['Trial']['Condition']:
-                trial['Trial']['Periph'].draw()
-                trial['Trial']['Periph_2'].draw()
-            
-            # periphery for all other conditions
-            elif 'Exp'and not 'Periph_donut' in trial['Trial']['Condition']:
-                trial['Trial']['Periph'].draw()            
-            
-            # draw central stimuli for all trials OTHER than donut_cent
-            aperture.inverted= False
-            trial['Trial']['Cent'].draw()
+                    # this will slowly increase the opacity of the second periphery
+                    # (same values as centre and repro) over the periphery
+                    grid.overlay('periphery', specs['Catch'], catch_table[frame])
             
-            # for the donut conditions = because needs to draw second central stimuli
-            # donut catch trial AND donut_cent need dobould stimuli drawn in centre
-            if trial['Trial']['Name'] == 'Donut':
-                if 'Catch' in trial['Trial']['Condition'] or 'Cent_donut' in trial['Trial']['Condition']:
-                    trial['Trial']['Cent_2'].draw()
+            # one draw for the centre and the periphery
+            grid.draw()
             
             # flip to window 
-            win.flip()
-            
-            # after set time, win cleared
-            if timer.getTime()>stim_duration:
-                win.flip()
-                run = False
+            flips.flip(win, 'stimulus')
+            if fixation.broken:
                 break
         
+        # after set time, win cleared
+        if not fixation.broken:
+            flips.flip(win, 'blank')
+        
         # append in data file if UI was reported or not
         if UI_was_seen == True:
-            data['Uniformity'].append(1)
+            row['Uniformity'] = 1
         else:
-            data['Uniformity'].append(0)
+            row['Uniformity'] = 0
         
-        # MSG TO EYETRACKER
-        #tracker.sendMessage(f'''MASK: trial index: {trials.thisIndex}. trial n: {trialNumber}, rep: {trials.thisRepN+1}, block: {block}''')
         # MASK = short blank before centre change to prevent 
         # effects of movement/change on the retina in the centre only
-        timer.reset()
-        while timer.getTime()<(mask_duration):
-            win.flip()
-            
-            if timer.getTime()>=(mask_duration): 
+        for frame in range(timeline['mask']):
+            if fixation.broken:
                 break
+            flips.flip(win, 'mask')
         
-        # SEND MESSAGE TO EYE TRACKER
-        #tracker.sendMessage(f'''CENTRE CHANGE: trial index: {trials.thisIndex}. trial n: {trialNumber}, rep: {trials.thisRepN+1}, block: {block}''')
         # 3. centre change 
         # CENTRE CHANGE = the central stimuli drawn match the periphery 
-        # this while loop includes the reproduction task because I made a mess
-        # I am too lazt to fix it so just dont touch anything 
-        myMouse.clickReset()
-        run_centre_change = True
-        # so the reproduction task doesnt start to run before mouse click 
-        run_repro = False 
-        # TIMER FOR REACTIONS TIMES
-        RT_timer = psychopy.core.Clock()
-        while run_centre_change and timer.getTime()>=mask_duration:
-            # re-draw peripheral stimuli
-            aperture.enabled = True
-            aperture.inverted= True
-            
-            # draws the same periphery as before 
-            trial['Trial']['Periph'].draw()
-            # only for Donut conditions: 
-            # incl catch and periph_donut because they both need a double centre 
-            if trial['Trial']['Name'] == 'Donut':
-                if 'Catch' in trial['Trial']['Condition'] or 'Periph_donut' in trial['Trial']['Condition']:
-                    trial['Trial']['Periph_2'].draw()
+        # centFill_RT = until the left click, the RT is measured
+        # blackOut and centFill_Repro = set number of frames, no RT
+        # REACTION TIMES = from the flip the centre change is first on screen
+        # (flips.onset) to the time the mouse press was stamped, both on the
+        # psychopy.core.getTime clock
+        row['RT'] = 'NaN'
+        row['RT_onset'] = 'NaN'
+        row['RT_response'] = 'NaN'
+        # clicks from the stimulus, blank and mask are not responses to the
+        # centre change
+        mouse_input.clear()
+        # the same periphery as before, new central stimuli
+        grid.show(phases['centre_change'])
+        frame = 0
+        while not fixation.broken and (timeline['centre_change'] is None or 
+                                       frame < timeline['centre_change']):
+            grid.draw()
             
-            # draw central stimuli 
-            aperture.inverted= False
-            # for all other stimuli types
-            if trial['Trial']['Name'] != 'Donut':
-                trial['Trial']['Cent_new'].draw()
-            
-            if trial['Trial']['Name'] == 'Donut':
-                trial['Trial']['Cent'].draw()
-                trial['Trial']['Cent_2_new'].draw()
-            
-            win.flip()
+            flips.flip(win, 'centre_change')
+            frame += 1
+            if fixation.broken:
+                break
             
-            mouseClicks = [0]
+            # mouse is read every frame (clicks only end the phase in
+            # centFill_RT, the other blocks ignore them)
+            mouse_events = mouse_input.drain()
             if block == 'centFill_RT':
-                mouseClicks = myMouse.getPressed()
-            # SET DURATION FOR BLACKOUT AND CENTFILL_REPRO TRIALS
-            elif block == 'blackOut' or block == 'centFill_Repro':
-                psychopy.core.wait(1.7)
-                mouseClicks[0] = 1
-                # SEND MESSAGE TO EYE TRACKER
-                #tracker.sendMessage(f'''CENT CHANGE TIMEOUT: trial index: {trials.thisIndex}. trial n: {trialNumber}, rep: {trials.thisRepN+1}, block: {block}''')
-            
-            if mouseClicks[0]==1:
-                # NO RT for black out trials, no uniformity reoccurs
-                # NP RT for repro cent fill, set duration 
-                if block == 'blackOut' or block =='centFill_Repro':
-                    data['RT'].append('NaN')
-                elif block == 'centFill_RT':
-                    # SEND MESSAGE TO EYE TRACKER
-                    #tracker.sendMessage(f'''RT CENT CHANGE:  trial index: {trials.thisIndex}. trial n: {trialNumber}, rep: {trials.thisRepN+1}, block: {block}''')
-                    data['RT'].append(round(RT_timer.getTime(),4))
+                # (a press stamped before the centre change was on screen is
+                # left over from the mask, not a response)
+                response = first_press(mouse_events, LEFT, flips.onset('centre_change'))
+                if response is not None:
+                    # SEND MESSAGE TO EYE TRACKER (time of the click)
+                    gaze.message('RT CENT CHANGE', response.time)
+                    row['RT_onset'] = flips.onset('centre_change')
+                    row['RT_response'] = response.time
+                    row['RT'] = round(response.time - row['RT_onset'],4)
+                    break
+        
+        if timeline['centre_change'] is not None and not fixation.broken:
+            # SEND MESSAGE TO EYE TRACKER
+            gaze.message('CENT CHANGE TIMEOUT', flips.last_flip)
+        
+        # noise grating between the centre change and the reproduction
+        # (none in centFill_RT, no reproduction there)
+        noise.start()
+        for frame in range(timeline['isi_noise']):
+            if fixation.broken:
+                break
+            noise.draw(frame)
+            flips.flip(win, 'isi_noise')
+        
+        # REPRODUCTION TASK
+        # ONLY the periph is drawn up
+        # scroll wheel changes the stimuli attributes of the periphery and
+        # draws to screen, participant clicks left mouse to submit
+        row['Reproduction'] = 'NaN'
+        run_repro = timeline['reproduction'] is None and not fixation.broken
+        grid.show(phases['reproduction'])
+        if trial['Trial']['Name'] == 'Colour':
+            grid.overlay('periphery', repro_spec, repro.value)
+        mouse_input.clear()
+        
+        while run_repro:
+            # every scroll and click since the last frame, in order: the
+            # scroll steps are added up and move the value once, a left
+            # click confirms (what comes after it is ignored)
+            ## SCROLL UP = Negative = bigger
+            ## SCROLL DOWN = Positive = smaller
+            if repro.update(mouse_input.drain()):
+                ## SIZE of the periphery
+                if trial['Trial']['Name'] == 'Size':
+                    grid.set_sizes('periphery', [repro.value*scale, repro.value])
                 
-                # so RT timer doesnt run in back
-                RT_timer = None
-                # reset timer for inter stim noise grating
-                timer.reset()
+                ## COLOUR opacity of the repro colour
+                elif trial['Trial']['Name'] == 'Colour':
+                    grid.overlay('periphery', repro_spec, repro.value)
                 
-                # after click, noise grating shown
-                while timer.getTime()<inter_stim_dur:
-                    if block == 'centFill_Repro' or block == 'blackOut':
-                        # remove apature 
-                        aperture.enabled = False
-                        noise.phase += (0.01 / 2, 0.005 / 2)
-                        noise.draw()
-                        win.flip()
-                    elif block == 'centFill_RT':
-                    # SKIPS THE NOISE BETWEEN REPRO CENT CHANGE
-                        data['Reproduction'].append('NaN')
-                        break
-                        
-                # when the timer exceeds the noise stim duration (specified at
-                # start of script) then reset mouse clicks and init reproduction
-                # task by setting run_repro to TRUE and run_centre_change to FALSE
-                # This way the loops do not over-ride eachother, and kinda resolves my mess
-                if timer.getTime()>=inter_stim_dur:
-                    if block == 'centFill_Repro' or block =='blackOut':
-                        myMouse.clickReset()
-                        run_repro = True
-                        run_centre_change = False
-                    elif block == 'centFill_RT':
-                        run_repro = False
-            
-            # REPRODUCTION TASK
-            # ONLY the periph is drawn up
-            # scroll wheel changes the stimuli attributes of the periphery and
-            # draws to screen, participant clicks right mouse to submit
-            aperture.enabled = True
-            aperture.inverted= True
-            myMouse.clickReset()
-            psychopy.event.clearEvents('mouse')
+            # Colour: periphery with the repro colour blended over it
+            grid.draw()
+            flips.flip(win, 'reproduction')
+            if fixation.broken:
+                break
             
-            while run_repro and timer.getTime()>inter_stim_dur:
-                # to exit reproduction task left click
-                leftClick_repro = myMouse.getPressed()[0]
-                ## SCROLL UP = Negative
-                ## SCROLL DOWN = Positive
-                scroll = myMouse.getWheelRel()[1]
-                # uses reproduction task element of stimulus dict
-                # can scroll up and down to change size uptil reaching limits
-                # limits = big and small stimuli +/-0.005 (bit of overshoot)
-                
-                if scroll < 0:
-                    ## SIZE INCREASE
-                    if trial['Trial']['Name'] == 'Size':
-                        trial['Trial']['Repro'].sizes += [(0.002*scale),0.002]
-                        if trial['Trial']['Repro'].sizes[1,1] > (big + 0.005):
-                            trial['Trial']['Repro'].sizes -= [(0.002*scale),0.002]
-                    
-                    ## COLOUR opacity INCREASE
-                    elif trial['Trial']['Name'] == 'Colour':
-                            trial['Trial']['Repro'].opacities += 0.02
-                            if trial['Trial']['Repro'].opacities[1] > 1:
-                                trial['Trial']['Repro'].opacities -= 0.02
-                
-                elif scroll > 0:
-                    ## SIZE DECREASE
-                    if trial['Trial']['Name'] == 'Size':
-                        trial['Trial']['Repro'].sizes -= [(0.002*scale),0.002]
-                        if trial['Trial']['Repro'].sizes[1,1] < (small - 0.005):
-                            trial['Trial']['Repro'].sizes += [(0.002*scale),0.002]
-                    
-                    ## COLOUR opacity DECREASE
-                    elif trial['Trial']['Name'] == 'Colour':
-                            trial['Trial']['Repro'].opacities -= 0.02
-                            if trial['Trial']['Repro'].opacities[1] < 0:
-                                trial['Trial']['Repro'].opacities += 0.02
+            if repro.confirmed:
+                # append data of final reproduction to dataframe
+                # (size or opacity of the repro stimuli)
+                row['Reproduction'] = repro.value
                 
-                #trial['Trial']['Repro'].sizes *= [scale,1]
-                
-                if trial['Trial']['Name'] == 'Colour':
-                    trial['Trial']['Periph'].draw()
-                
-                trial['Trial']['Repro'].draw()
-                win.flip()
-                
-                
-                if (leftClick_repro):
-                    # append data of final reproduction to dataframe
-                    if trial['Trial']['Name'] == 'Size':
-                        data['Reproduction'].append(trial['Trial']['Repro'].sizes[1,1])
-                    elif trial['Trial']['Name'] == 'Colour':
-                        data['Reproduction'].append(trial['Trial']['Repro'].opacities[1])
-                    
-                    run_repro = False
+                run_repro = False
+        
+        ## FIXATION BROKEN: nothing of this trial is saved, it runs again later
+        if fixation.broken:
+            requeue_trial(queue, trial)
+            trialNumber -= 1
+            continue
         
         ## EYE TRACKER RECORDING FOR THIS TRIAL DONE
-        #tracker.setRecordingState(False)
+        # samples of the trial are written to the block's gaze file now
+        gaze.end_trial()
         
-        ### BACK UP DATA - live updating to txt file
-        # make list of current trial data
-        new_data_row = []
-        # for every key in the data dict, append a new value
-        for key in data:
-        #for key in wtf_trial_numbers:
-            # for the other trials: for key in keys, get the number 
-            # in each list appended to they keys that 
-            # corresponds to the current trial number 
-            # INDEXING STARTS AT 0 AND TRIALS START AT 1!!!
-            # so TRIAL NUMBER - 1
-            #new_data_row.append(wtf_trial_numbers[key][trialNumber-1])
-            new_data_row.append(data[key][trialNumber-1])
+        # times this trial was aborted before
+        row['Fix_breaks'] = trial['Fix_breaks']
         
-        # Append new line to txt file
-        new_data_row = ",".join(map(str, new_data_row))
-        backUp.write(str(new_data_row)+"\n")
+        ### SAVE DATA - one row per trial, appended to the data file straight away
+        # write ahead: goes in the session log first, then in the data file
+        fields = data_file.format(row)
+        session_log.trial(log_part[0], log_part[1], fields)
+        data_file.write_fields(fields)
         
         # clear window
-        win.flip()
+        flips.flip(win, 'blank')
         myMouse.clickReset()
         
+        ### FRAME TIMING of this trial, same trial number as the data row
+        timing = flips.summary()
+        timing['Trial_n'] = trialNumber
+        timing_file.write(timing)
+        
 
 
-## INIT DATA FRAME
-
-data = {'Sub_ID':[],'Block_n':[],'Block_type': [],'Trial_n':[],'Trial_Rep_n':[],
-        'Rep_n':[], 'Trial_index':[],'Stimuli':[],'Condition':[],'Exp':[],
-        'Catch_UI':[], 'Catch_latency':[],'Cent_size':[],'Cent_opacity':[],
-        'RT':[],'Reproduction':[],'Uniformity':[]}
-
-# headers to txt file
-backUp.write (str(list(data.keys()))+'\n')
+## DATA FILES
+# columns (and their types) are in UI_data.DATA_COLUMNS
+data_file = SessionWriter(filename, DATA_COLUMNS, 
+                          flush_every=data_flush_every, fsync=data_fsync)
+
+# frame timing of every trial (flips, real phase durations, dropped frames)
+# one row per trial, Trial_n matches the data file
+timing_file = SessionWriter(filename+'_timing.csv', [('Trial_n', int)] + flips.columns(),
+                            flush_every=data_flush_every)
+
+# session log, to resume the session if it gets interrupted
+session_log = SessionLog(session_log_name(filename), fsync=data_fsync)
+if resume is None:
+    session_log.session(info)
+else:
+    # rows that got into the log but not into the data file (crash in between)
+    for fields in resume['rows'][data_file.rows_written:]:
+        data_file.write_fields(fields)
+
+# block number and part ('practice' or 'main') RUN_TRIALS is running
+log_part = None
+
+def block_trials(block_n, part, stim_list, make_sequence):
+    # trials of one part of a block, logged before they run
+    # when resuming, the logged sequence is used and finished trials are dropped
+    global log_part
+    log_part = (block_n, part)
+    if resume is not None and log_part in resume['parts']:
+        logged = resume['parts'][log_part]
+        return sequence_from_log(logged['trials'], stim_list)[logged['done']:]
+    
+    trials = make_sequence()
+    session_log.block(block_n, part, sequence_to_log(trials), rng.bit_generator.state)
+    return trials
+
+# where aborted trials go back in the queue
+requeue_rng = np.random.default_rng(np.random.SeedSequence(info['seed']).spawn(3)[2])
+
+def requeue_trial(queue, trial):
+    # trial aborted (fixation broken): back in the queue after a random number
+    # of the trials still to run (not straight away if there are others), or
+    # dropped if it broke too often. Logged, so --resume runs the same order
+    gaze.message('FIXATION BROKEN', fixation.broken_time)
+    gaze.end_trial()
+    flips.flip(win, 'blank')
+    trial = dict(trial, Fix_breaks=trial['Fix_breaks'] + 1)
+    if trial['Fix_breaks'] >= fixation_max_breaks:
+        later = None
+        print('trial %s dropped, fixation broken %i times' % (trial['Trial_index'], trial['Fix_breaks']))
+    else:
+        later = int(requeue_rng.integers(min(1, len(queue)), len(queue) + 1))
+        queue.insert(later, trial)
+    session_log.requeue(log_part[0], log_part[1], later, sequence_to_log([trial])[0])
 
-# making a df
-df = pd.DataFrame(data)
+def block_finished(block_n):
+    # already done in the session that is being resumed
+    return (resume is not None and 
+            resume['parts'].get((block_n, 'main'), {}).get('finished', False))
 
 
 #### EXPERIMENT STRUCTURE 
 # Button for demos
-instructions_button = psychopy.visual.Rect(win, width=0.2, height=0.1, 
+instructions_button = backend.visual('Rect', win, width=0.2, height=0.1, 
                             units='norm', fillColor=[1,1,1], 
                             fillColorSpace='rgb', pos=(0.7,-0.7), size=None)
 
 
-instructions_button_text = psychopy.visual.TextBox(win,
+instructions_button_text = backend.visual('TextBox', win,
                          text='Ok, got it!',
                          font_size=30,
                          font_color=[0,0,0],
@@ -1179,19 +1296,35 @@ instructions_button_text = psychopy.visual.TextBox(win,
                          units='norm'
                          )
 
+# TEXT SCREENS: every text is laid out once and kept as an image, the same
+# for the button (its Rect is still used for the clicks), see UI_text.py
+text_cache = TextCache(backend, win)
+text_cache.prerender(text_screen, [welcome, CF_instructions_RT, CF_instructions_REPRO_a,
+                                   BO_instructions_a, CF_instructions_REPRO_b,
+                                   BO_instructions_b, start_eyetracking, start_of_block,
+                                   test_trials_complete, end_of_block, end_of_experiment])
+instructions_button_image = capture(backend, win, [instructions_button, instructions_button_text],
+                                    rect=(0.6,-0.65,0.8,-0.75))
+
 
 myMouse.clickReset()
 experiment_run = True
 START = True
 
+# for the trials per sec at the end (real time) and the session duration
+session_start_time = psychopy.core.getTime()
+session_start_clock = clock.getTime()
+session_start_rows = data_file.rows_written
+
 while experiment_run:
     # instructions 
     # welcome screen, press space tp start experiment 
     if START == True:
-        text_screen.setText(welcome) 
-        text_screen.draw()
+        text_cache.draw(text_screen, welcome)
         win.flip()
-        psychopy.event.waitKeys()
+        # noise textures go to the graphics card now, not in the first trial
+        noise.make_stims()
+        backend.wait_keys()
         START == False
     
     # block counter 
@@ -1202,54 +1335,56 @@ while experiment_run:
         win.setMouseVisible(True)
         
         block_n += 1
+        if block_finished(block_n):
+            continue
         
         instructions_1 = True
         instructions_2 = False
         demo_run = True
-        demo_timer = psychopy.core.Clock()
+        demo_timer = Timer(clock)
         
         while demo_run == True: 
             while instructions_1 == True:
                 # instructions 1 + centre change demo
                 if block == 'centFill_Repro' or block == 'blackOut':
-                    keys = psychopy.event.getKeys(keyList=['space'])
-                    demo_aperture.enabled = True
-                    demo_aperture.inverted= True
+                    keys = backend.get_keys(keyList=['space'])
                 elif block == 'centFill_RT': 
-                    demo_aperture.enabled = False
                     keys = None
                 
                 # TEXT
                 # for centre fill blocks, set the instructions 
                 if block == 'centFill_RT': 
-                    text_screen.setText(CF_instructions_RT) 
+                    instructions_text = CF_instructions_RT
                 # for black out blocks, set the instructions 
                 elif block == 'centFill_Repro': 
-                    text_screen.setText(CF_instructions_REPRO_a)
+                    instructions_text = CF_instructions_REPRO_a
                 # for black out blocks, set the instructions 
                 elif block == 'blackOut': 
-                    text_screen.setText(BO_instructions_a)
-                    
-                text_screen.draw()
-                instructions_button.draw()
-                instructions_button_text.draw()
+                    instructions_text = BO_instructions_a
+                
+                # cached images, drawn first (see UI_text.py)
+                text_cache.draw(text_screen, instructions_text)
+                instructions_button_image.draw()
                 
                 # draw periph
                 if demo_timer.getTime() < 7:
                     demo_periph.draw()
+                    # no centre change for RT blocks, the whole grid is the
+                    # periphery colour
+                    if block == 'centFill_RT':
+                        demo_fill.draw()
                 
                 # CENTRE STIMULI CHANGE + PERIPH CHANGE 
                 # first centre drawn 
                 # ONLY REPRO AND BLACKOUT cent change
                 if block == 'centFill_Repro' or block == 'blackOut':
-                    demo_aperture.inverted= False
                     if demo_timer.getTime() < 4:
                         demo_cent.draw()
                     # draw new central stimuli
                     elif demo_timer.getTime() > 4 and demo_timer.getTime() < 7:
                         # for filled centre 
                         if block == 'centFill_Repro': 
-                            demo_periph.draw()
+                            demo_fill.draw()
                         # for black out centre 
                         elif block == 'blackOut':
                             demo_cent.opacities = 0
@@ -1268,7 +1403,7 @@ while experiment_run:
                     # setting opacities to 1
                     demo_periph.opacities = 1
                     # set opacity of overlay color for repro task 0.5
-                    demo_cent.opacities = 0.5
+                    demo_overlay.opacities = 0.5
                 elif myMouse.isPressedIn(instructions_button, buttons=[0]):
                     demo_timer = None
                     instructions_2 = False
@@ -1276,40 +1411,37 @@ while experiment_run:
                     demo_run = False
                     
             while instructions_2 == True:
-                keys = psychopy.event.getKeys(keyList=['space'])
+                keys = backend.get_keys(keyList=['space'])
                 scroll = myMouse.getWheelRel()[1]
-                demo_aperture.inverted= True
                 
                 # TEXT
                 # for centre fill blocks, set the instructions 
                 if block == 'centFill_Repro': 
-                    text_screen.setText(CF_instructions_REPRO_b) 
+                    instructions_text = CF_instructions_REPRO_b
                 # for black out blocks, set the instructions 
                 if block == 'blackOut': 
-                    text_screen.setText(BO_instructions_b)
-                text_screen.draw()
-                instructions_button.draw()
-                instructions_button_text.draw()
+                    instructions_text = BO_instructions_b
+                text_cache.draw(text_screen, instructions_text)
+                instructions_button_image.draw()
                 
                 # draw the background colour
                 demo_periph.draw()
-                demo_cent.draw()
+                demo_overlay.draw()
                 
                 if scroll < 0:
-                    demo_cent.opacities += 0.05
-                    #demo_cent.draw()
-                    if demo_cent.opacities[1] > 1:
-                        demo_cent.opacities -= 0.05
-                        #demo_cent.draw()
+                    demo_overlay.opacities += 0.05
+                    #demo_overlay.draw()
+                    if demo_overlay.opacities[1] > 1:
+                        demo_overlay.opacities -= 0.05
+                        #demo_overlay.draw()
                 
                 elif scroll > 0:
-                    demo_cent.opacities -= 0.05
-                    #demo_cent.draw()
-                    if demo_cent.opacities[1] < 0:
-                        demo_cent.opacities += 0.05
-                        #demo_cent.draw()
+                    demo_overlay.opacities -= 0.05
+                    #demo_overlay.draw()
+                    if demo_overlay.opacities[1] < 0:
+                        demo_overlay.opacities += 0.05
+                        #demo_overlay.draw()
                 
-                demo_aperture.inverted= False
                 
                 win.flip()
                 
@@ -1319,6 +1451,7 @@ while experiment_run:
                     instructions_1 = True
                     demo_periph.opacities = 1
                     demo_cent.opacities = 1
+                    demo_overlay.opacities = 1
                 elif myMouse.isPressedIn(instructions_button, buttons=[0]):
                     demo_timer = None
                     instructions_2 = False
@@ -1327,97 +1460,96 @@ while experiment_run:
                     
         
         if demo_run == False:
-            aperture.enabled = False
-            text_screen.setText(start_eyetracking)
-            text_screen.draw()
+            text_cache.draw(text_screen, start_eyetracking)
             win.flip()
-        psychopy.event.waitKeys()
+        backend.wait_keys()
         
         # EYE TRACKER CALIBRATION
-        #tracker.runSetupProcedure()
+        gaze.calibrate()
+        gaze.start_block(block_n)
         
-        text_screen.setText(start_of_block)
-        text_screen.draw()
+        text_cache.draw(text_screen, start_of_block)
         win.flip()
-        psychopy.event.waitKeys()
+        backend.wait_keys()
         
         fix.autoDraw = True
         win.setMouseVisible(False)
         
         if block == 'centFill_RT' or block == 'centFill_Repro':
             # RUNS TEST TRIALS FOR BLOCK
-            test_trials_CF = psychopy.data.TrialHandler(trialList=CF_test_stim_list, nReps=2, method = 'sequential')
-            # trial number starts at 0, will end at 4 after this practice block
-            if block == 'centFill_RT':
-                RUN_TRIALS(test_trials_CF, block, 'NaN', 0)
-            elif block == 'centFill_Repro':
-                RUN_TRIALS(test_trials_CF, block, 'NaN', len(data['Reproduction']))
+            test_trials_CF = block_trials(block_n, 'practice', CF_test_stim_list,
+                lambda: make_trial_sequence(CF_test_stim_list, 2, rng, method = 'sequential'))
+            # trial number = number of rows in the data file so far
+            RUN_TRIALS(test_trials_CF, block, 'NaN', data_file.rows_written)
+            session_log.part_end(block_n, 'practice')
             
-            aperture.enabled = False
             # after test trials 
-            text_screen.setText(test_trials_complete)
-            text_screen.draw()
+            text_cache.draw(text_screen, test_trials_complete)
             win.flip()
-            psychopy.event.waitKeys()
+            backend.wait_keys()
             
-            trials = psychopy.data.TrialHandler(trialList= centFill_stim_list, nReps=n_trials, method = 'random')
-            # next trial number always starts at the current length of the dataframe - 1! 
-            RUN_TRIALS(trials, block, block_n, len(data['Reproduction']))
-            
-            # save dict as df
-            df =  pd.DataFrame.from_dict(data)
-            # save dataframe as csv
-            df.to_csv(filename, index = False, header=True)
+            trials = block_trials(block_n, 'main', centFill_stim_list,
+                lambda: make_trial_sequence(centFill_stim_list, n_trials, rng, method = 'random',
+                                            latency_catch_every=latency_catch_every))
+            RUN_TRIALS(trials, block, block_n, data_file.rows_written)
+            session_log.part_end(block_n, 'main')
             
             
             
             fix.autoDraw = False
-            aperture.enabled = False
             # END OF BLOCK BREAK
-            text_screen.setText(end_of_block)
-            text_screen.draw()
+            text_cache.draw(text_screen, end_of_block)
             win.flip()
-            psychopy.event.waitKeys()
+            backend.wait_keys()
             
             
             
         elif block == 'blackOut':
             # RUNS TEST TRIALS FOR BLOCK
-            test_trials_BO = psychopy.data.TrialHandler(trialList=BO_test_stim_list, nReps=2, method = 'sequential')
-            RUN_TRIALS(test_trials_BO, block, 'NaN', len(data['Reproduction']))
+            test_trials_BO = block_trials(block_n, 'practice', BO_test_stim_list,
+                lambda: make_trial_sequence(BO_test_stim_list, 2, rng, method = 'sequential'))
+            RUN_TRIALS(test_trials_BO, block, 'NaN', data_file.rows_written)
+            session_log.part_end(block_n, 'practice')
             
             # after test trials 
-            aperture.enabled = False
-            text_screen.setText(test_trials_complete)
-            text_screen.draw()
+            text_cache.draw(text_screen, test_trials_complete)
             win.flip()
-            psychopy.event.waitKeys()
-            
-            trials = psychopy.data.TrialHandler(trialList= blackOut_stim_list, nReps=n_trials, method = 'random')
-            RUN_TRIALS(trials, block, block_n, len(data['Reproduction']))
+            backend.wait_keys()
             
-            # save dict as df
-            df =  pd.DataFrame.from_dict(data)
-            # save dataframe as csv
-            df.to_csv(filename, index = False, header=True)
+            trials = block_trials(block_n, 'main', blackOut_stim_list,
+                lambda: make_trial_sequence(blackOut_stim_list, n_trials, rng, method = 'random',
+                                            latency_catch_every=latency_catch_every))
+            RUN_TRIALS(trials, block, block_n, data_file.rows_written)
+            session_log.part_end(block_n, 'main')
         
-        aperture.enabled = False
         fix.autoDraw = False
     
-    # save dict as df
-    df =  pd.DataFrame.from_dict(data)
-    # save dataframe as csv
-    df.to_csv(filename, index = False, header=True)
-    # Close the file with live updating
-    backUp.close()
+    # Close the data files (every trial is already in them)
+    data_file.close()
+    timing_file.close()
+    session_log.end()
+    session_log.close()
     
     # end experiment
-    text_screen.setText(end_of_experiment)
-    text_screen.draw()
+    text_cache.draw(text_screen, end_of_experiment)
     win.flip()
-    psychopy.event.waitKeys()
+    backend.wait_keys()
     
     # is set to true automatically at start 
-    # tracker.setConnectionState(False)
+    gaze.close()
     
     experiment_run = False
+
+# frame counts for runs without a screen
+if args.backend == 'null':
+    print(win.stats())
+
+# THROUGHPUT of unattended runs (trials of this session per sec, instructions
+# included), the benchmark for changes to the trial loop
+if args.simulate or args.backend == 'null':
+    session_trials = data_file.rows_written - session_start_rows
+    session_secs = psychopy.core.getTime() - session_start_time
+    print('%i trials in %.2f s (%.1f trials per sec)' 
+          % (session_trials, session_secs, session_trials / max(session_secs, 1e-9)))
+    if clock.virtual:
+        print('session time on the virtual clock: %.1f s' % (clock.getTime() - session_start_clock))
@@ -0,0 +1,5 @@
+# the UI_*.py modules are next to the experiment script, not a package
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,41 @@
+import json
+
+import UI_benchmarks
+
+
+BASELINE = {'backend': 'null', 'machine': {},
+            'results': {'fast': 1e-6, 'slow': 100e-6, 'output/trial_fsync': 300e-6}}
+
+
+def test_regression_needs_tolerance_and_noise_floor():
+    # 2x slower but only by 1 us = noise, 50% slower by 50 us = regression
+    results = {'fast': 2e-6, 'slow': 150e-6}
+    assert UI_benchmarks.compare(results, BASELINE, 0.25, 10e-6) == ['slow']
+
+
+def test_within_tolerance_is_not_a_regression():
+    results = {'fast': 1e-6, 'slow': 120e-6, 'new': 5e-6}
+    assert UI_benchmarks.compare(results, BASELINE, 0.25, 10e-6) == []
+
+
+def test_per_benchmark_tolerance():
+    # fsync gets 100%: 1.8x is fine, 2.5x isn't
+    assert UI_benchmarks.compare({'output/trial_fsync': 540e-6}, BASELINE, 0.25, 10e-6) == []
+    assert UI_benchmarks.compare({'output/trial_fsync': 750e-6}, BASELINE, 0.25, 10e-6) == \
+        ['output/trial_fsync']
+
+
+def test_main_saves_and_checks_baseline(tmp_path):
+    path = str(tmp_path / 'baseline.json')
+    args = ['--baseline', path, '--only', 'grid/', '--repeat', '1']
+    assert UI_benchmarks.main(args + ['--save-baseline']) == 0
+    with open(path) as baseline_file:
+        baseline = json.load(baseline_file)
+    assert sorted(baseline['results']) == ['grid/Colour', 'grid/Size']
+
+    # a baseline 10x faster than this machine = regression, exit status 1
+    for name in baseline['results']:
+        baseline['results'][name] /= 10
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file)
+    assert UI_benchmarks.main(args) == 1
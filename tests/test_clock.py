@@ -0,0 +1,29 @@
+import pytest
+
+from UI_clock import VirtualClock, Timer
+
+
+def test_virtual_frames_do_not_drift():
+    # an hour at 60 Hz, every flip exactly frame n / 60
+    clock = VirtualClock()
+    for n in range(1, 216001):
+        t = clock.next_frame(1.0 / 60)
+        if n % 60 == 0:
+            assert t == n // 60
+    assert clock.getTime() == 3600.0
+
+
+def test_virtual_wait_and_timer():
+    clock = VirtualClock(start=9.5)
+    timer = Timer(clock)
+    clock.wait(0.1)
+    clock.wait(0.1)
+    assert clock.getTime() == 9.7
+    # the timer subtracts floats, only the clock itself is exact
+    assert timer.getTime() == pytest.approx(0.2)
+
+
+def test_virtual_clock_only_goes_forward():
+    clock = VirtualClock()
+    with pytest.raises(ValueError):
+        clock.advance(-1)